@@ -1,7 +1,37 @@
+import sys
+import argparse
+from memory import enable_profiling, set_budget
 from inputs import initOptions
 from display import show_welcome
 from log import logger
 
+### Command line ###
+def positive_int(value: str) -> int:
+    try:
+        number = int(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected a whole number, got {value!r}")
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"must be at least 1, got {number}")
+    return number
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="VIN CLI. Run without arguments for the interactive menu.")
+    parser.add_argument("--profile-memory", action="store_true",
+                        help="record allocations per stage and write autolookup_memory_report.txt at exit")
+    parser.add_argument("--memory-budget", type=float, metavar="MB",
+                        help="warn and keep batch results on disk when memory use nears this budget")
+    commands = parser.add_subparsers(dest="command")
+
+    prefetch = commands.add_parser("prefetch", help="Warm the history cache, e.g. from cron before business hours")
+    source = prefetch.add_mutually_exclusive_group(required=True)
+    source.add_argument("--file", help="file with one VIN per line")
+    source.add_argument("--recent", type=positive_int, metavar="N", help="the N most recently looked-up VINs")
+    source.add_argument("--frequent", type=positive_int, metavar="N", help="the N most frequently looked-up VINs")
+    prefetch.add_argument("--rate", type=float, default=None, help="maximum lookups per second")
+    prefetch.add_argument("--workers", type=positive_int, default=None, help="concurrent lookups")
+    return parser.parse_args(argv)
+
 ### Main Function ###
 def main(firstUse=True):
     if firstUse:
@@ -10,10 +40,24 @@ def main(firstUse=True):
     while True:
         initOptions()
 
-    
+
 if __name__ == "__main__":
+    args = parse_args()
+    if args.profile_memory:
+        enable_profiling()
+    if args.memory_budget:
+        set_budget(args.memory_budget)
     try:
-        main(firstUse=True)    
-    except Exception as e:  
+        if args.command == "prefetch":
+            from prefetch import run_prefetch, PREFETCH_RATE, PREFETCH_WORKERS
+            sys.exit(run_prefetch(
+                file=args.file,
+                recent=args.recent,
+                frequent=args.frequent,
+                rate=PREFETCH_RATE if args.rate is None else args.rate,
+                workers=PREFETCH_WORKERS if args.workers is None else args.workers,
+            ))
+        main(firstUse=True)
+    except Exception as e:
         logger.exception("Unhandled exception caused program crash:")
-        print("\n[red]A critical error has occurred. Check vin_cli.log for details.[/red]")
\ No newline at end of file
+        print("\n[red]A critical error has occurred. Check vin_cli.log for details.[/red]")
@@ -1,12 +1,39 @@
+import os
 import requests
 import time
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor, FIRST_COMPLETED, wait
+from datetime import datetime
 from rich.spinner import Spinner
 from rich.live import Live
 from rich.console import Console
 from rich import print
 
+from log import logger
+from memory import profiled
+from providers import Provider, DbVinProvider, NhtsaProvider, normalize_nhtsa_result
+from vinRecord import VinRecord
+
 VIN_API_URL = ("https://db.vin/api/v1/vin/{vin}")
 RECALL_API_URL = ("https://api.nhtsa.gov/recalls/recallsByVehicle?vin={vin}")
+NHTSA_DECODE_URL = ("https://vpic.nhtsa.dot.gov/api/vehicles/DecodeVinValues/{vin}?format=json")
+NHTSA_BULK_DECODE_URL = ("https://vpic.nhtsa.dot.gov/api/vehicles/DecodeVINValuesBatch/")
+REQUEST_TIMEOUT = 15
+# Batch lookups decode uncached VINs in bulk POST requests instead of one request per VIN
+BULK_DECODE = os.environ.get("AUTOLOOKUP_BULK", "1") == "1"
+# Send a second request to the next provider when the first is slower than its p95 latency
+HEDGE_REQUESTS = os.environ.get("AUTOLOOKUP_HEDGE", "1") == "1"
+# Concurrent requests per provider; abandoned hedge requests only hold their own provider's threads
+PROVIDER_WORKERS = int(os.environ.get("AUTOLOOKUP_PROVIDER_WORKERS", "16"))
+# Seconds a finished lookup is still shared with callers asking for the same VIN
+SINGLE_FLIGHT_TTL = float(os.environ.get("AUTOLOOKUP_SINGLE_FLIGHT_TTL", "5"))
+
+# Decode providers in order of preference
+BULK_PROVIDER = NhtsaProvider(NHTSA_DECODE_URL, NHTSA_BULK_DECODE_URL)
+PROVIDERS = [DbVinProvider(VIN_API_URL), BULK_PROVIDER]
+_provider_pools = {}  # provider name -> executor
+_provider_pools_lock = threading.Lock()
 
 class VINDataError(Exception):
     pass
@@ -14,7 +41,7 @@ class VINDataError(Exception):
 rich_console = Console()
 
 ### Retry Logic ####
-def retry(func, attempts=3, delay=1, backoff=2, exceptions=(Exception)):
+def retry(func, attempts=3, delay=1, backoff=2, exceptions=(Exception), quiet=False):
     for attempt in range(1, attempts + 1):
         try:
             return func()
@@ -22,6 +49,12 @@ def retry(func, attempts=3, delay=1, backoff=2, exceptions=(Exception)):
             if attempt == attempts:
                 # Last attempt → re-raise
                 raise
+            if quiet:
+                # Batch mode owns the terminal (progress bar), so just wait
+                logger.warning(f"Attempt {attempt}/{attempts} failed: {e}")
+                time.sleep(delay)
+                delay *= backoff
+                continue
             print(f"[yellow]Attempt {attempt}/{attempts} failed: {e}[/yellow]")
 
             with Live(refresh_per_second=10) as live:
@@ -45,16 +78,273 @@ def validate_vin(vin: str):
 
     return vin
 
+### Rate Limiting ###
+class RateLimiter:
+    """Spaces calls to ``wait`` at least ``1 / rate`` seconds apart across threads."""
+
+    def __init__(self, rate: float):
+        self.interval = 1.0 / rate if rate > 0 else 0.0
+        self._next = time.monotonic()
+        self._lock = threading.Lock()
+
+    def wait(self):
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next)
+            self._next = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+### Single-flight Lookups ###
+class SingleFlight:
+    """Collapses lookups of the same key into one call.
+
+    Callers arriving while a call is in flight wait for it and share its result, and a
+    successful result is reused for ``ttl`` seconds so back-to-back callers that beat the
+    history save do not fetch again. Failures are shared with waiters but never reused.
+    """
+
+    def __init__(self, ttl: float = 0.0):
+        self.ttl = ttl
+        self.calls = 0
+        self.shared = 0
+        self._lock = threading.Lock()
+        self._inflight = {}
+        self._recent = OrderedDict()  # key -> (expires, result), oldest first
+
+    def do(self, key, func):
+        with self._lock:
+            self.calls += 1
+            now = time.monotonic()
+            while self._recent and next(iter(self._recent.values()))[0] <= now:
+                self._recent.popitem(last=False)
+            if key in self._recent:
+                self.shared += 1
+                return self._recent[key][1]
+            future = self._inflight.get(key)
+            leader = future is None
+            if leader:
+                future = self._inflight[key] = Future()
+            else:
+                self.shared += 1
+
+        if not leader:
+            return future.result()
+
+        try:
+            result = func()
+        except BaseException as e:
+            with self._lock:
+                del self._inflight[key]
+            future.set_exception(e)
+            raise
+        with self._lock:
+            del self._inflight[key]
+            if self.ttl > 0:
+                self._recent[key] = (time.monotonic() + self.ttl, result)
+        future.set_result(result)
+        return result
+
+    def stats(self) -> tuple[int, int]:
+        with self._lock:
+            return self.calls, self.shared
+
+# Full decodes keyed by normalized VIN
+VIN_LOOKUPS = SingleFlight(ttl=SINGLE_FLIGHT_TTL)
+
+def _vin_key(vin: str) -> str:
+    return vin.strip().upper()
+
+def _decode_shared(vin: str, limiter: RateLimiter = None) -> VinRecord:
+    vin = _vin_key(vin)
+    return VIN_LOOKUPS.do(vin, lambda: _decode(vin, limiter=limiter))
+
 ### VIN API Interaction ###
-def get_vin_data(vin: str) -> dict:
+def _provider_fault(status_code: int) -> bool:
+    # Server errors and throttling say the provider is in trouble; other 4xx are about the VIN
+    return status_code >= 500 or status_code == 429
+
+def _fetch_from(provider: Provider, vin: str, etag: str = None, last_modified: str = None) -> VinRecord | None:
+    # Returns None when the provider confirms a conditional request is still current (304).
+    # Only transport errors, server errors and unreadable responses count against its health.
+    start = time.perf_counter()
+    try:
+        response = provider.request(vin, etag=etag, last_modified=last_modified, timeout=REQUEST_TIMEOUT)
+    except requests.RequestException:
+        provider.record_failure()
+        raise
+    latency = time.perf_counter() - start
+
+    if response.status_code == 304:
+        provider.record_success(latency)
+        return None
+    if not response.ok:
+        if _provider_fault(response.status_code):
+            provider.record_failure()
+        else:
+            provider.record_success(latency)
+        raise VINDataError(
+            f"API error {response.status_code}: {response.text}"
+        )
+    try:
+        payload = response.json()
+    except ValueError:
+        provider.record_failure()
+        raise VINDataError(f"{provider.name} returned an unreadable response")
+
+    # The provider answered; a VIN it cannot decode is not a sign it is unhealthy
+    provider.record_success(latency)
+    data = provider.normalize(payload)
+    if data is None:
+        raise VINDataError(f"{provider.name} could not decode VIN {vin}")
+    return VinRecord.from_payload(
+        data,
+        vin=vin,
+        fetched_at=datetime.now().isoformat(),
+        etag=response.headers.get("ETag"),
+        last_modified=response.headers.get("Last-Modified"),
+        provider=provider.name,
+    )
+
+def _provider_pool(provider: Provider) -> ThreadPoolExecutor:
+    with _provider_pools_lock:
+        pool = _provider_pools.get(provider.name)
+        if pool is None:
+            pool = _provider_pools[provider.name] = ThreadPoolExecutor(
+                max_workers=PROVIDER_WORKERS, thread_name_prefix=f"vin-{provider.name}")
+        return pool
+
+def _started_fetch(started: list, limiter: RateLimiter, provider: Provider, vin: str, **validators):
+    # Marks when the request is sent; queueing and rate-limit waits do not count towards hedging
+    if limiter is not None:
+        limiter.wait()
+    started.append(time.monotonic())
+    return _fetch_from(provider, vin, **validators)
+
+def _ordered_providers(preferred: str = None) -> list[Provider]:
+    # Healthy providers first (the preferred one leading), otherwise configured order;
+    # unhealthy providers stay at the end as a last resort
+    return sorted(PROVIDERS, key=lambda provider: (not provider.healthy(), provider.name != preferred))
+
+def _decode(vin: str, record: VinRecord = None, limiter: RateLimiter = None) -> VinRecord | None:
+    # With a limiter every request, fallbacks included, takes a slot. Those unattended lookups
+    # are not hedged: they are not latency sensitive and hedges would only spend their rate.
+    providers = _ordered_providers(preferred=record.provider if record else None)
+    pending = {}
+    errors = []
+
+    def submit(provider):
+        # Validators are only meaningful to the provider that issued them
+        validators = {}
+        if record is not None and record.provider in (None, provider.name):
+            validators = {"etag": record.etag, "last_modified": record.last_modified}
+        started = []
+        future = _provider_pool(provider).submit(_started_fetch, started, limiter, provider, vin, **validators)
+        pending[future] = (provider, time.monotonic(), started)
+
+    submit(providers.pop(0))
+    while pending:
+        # Hedge: if the current request outlives the provider's p95, race the next provider.
+        # The delay counts from when a pool thread started the request, not from submission.
+        timeout = None
+        if HEDGE_REQUESTS and limiter is None and providers:
+            last = list(pending)[-1]
+            provider, submitted, started = pending[last]
+            hedge_delay = provider.hedge_delay()
+            timeout = max(0.0, hedge_delay - (time.monotonic() - (started[0] if started else submitted)))
+        done, _ = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+        if not done:
+            if started and time.monotonic() - started[0] < hedge_delay:
+                continue
+            if not started and last.cancel():
+                # Still queued behind this provider's own slow requests, so it is backed up
+                pending.pop(last)
+                errors.append(f"{provider.name}: busy")
+            logger.info(f"Hedging VIN {vin} lookup to {providers[0].name} after {hedge_delay:.2f}s")
+            submit(providers.pop(0))
+            continue
+
+        for future in done:
+            provider = pending.pop(future)[0]
+            try:
+                return future.result()
+            except Exception as e:
+                logger.warning(f"VIN provider {provider.name} failed for {vin}: {e}")
+                errors.append(f"{provider.name}: {e}")
+
+        # Fall back to the next provider as soon as one fails
+        if providers and not pending:
+            submit(providers.pop(0))
+
+    raise VINDataError("All VIN providers failed. " + "; ".join(errors))
+
+@profiled("fetch")
+def get_vin_data(vin: str, show_spinner: bool = True, limiter: RateLimiter = None) -> VinRecord:
+    if not show_spinner:
+        return _decode_shared(vin, limiter)
 
     with rich_console.status("[bold green]Fetching VIN data...[/bold green]", spinner="dots"):
-        response = requests.get(VIN_API_URL.format(vin=vin.strip()))
-        if not response.ok:
-            raise VINDataError(
-                f"API error {response.status_code}: {response.text}"
-            )
-        return response.json()
+        return _decode_shared(vin, limiter)
+
+## Bulk decode for batch lookups ##
+def _decode_chunk(vins: list[str]) -> dict:
+    start = time.perf_counter()
+    try:
+        response = BULK_PROVIDER.request_bulk(vins, timeout=REQUEST_TIMEOUT)
+    except requests.RequestException:
+        BULK_PROVIDER.record_failure()
+        raise
+    if not response.ok:
+        if _provider_fault(response.status_code):
+            BULK_PROVIDER.record_failure()
+        raise VINDataError(f"Bulk API error {response.status_code}: {response.text}")
+    try:
+        results = response.json().get("Results") or []
+    except ValueError:
+        BULK_PROVIDER.record_failure()
+        raise VINDataError("Bulk API returned an unreadable response")
+    BULK_PROVIDER.record_success(time.perf_counter() - start)
+
+    fetched_at = datetime.now().isoformat()
+    records = {}
+    for result in results:
+        vin = (result.get("VIN") or "").strip().upper()
+        data = normalize_nhtsa_result(result)
+        if vin in vins and data is not None:
+            records[vin] = VinRecord.from_payload(data, vin=vin, fetched_at=fetched_at, provider=BULK_PROVIDER.name)
+    return records
+
+def decode_vins_bulk(vins: list[str]):
+    """Decode many VINs with chunked bulk requests, yielding ``(vin, record, error)`` per VIN.
+
+    VINs the bulk response did not decode, or whose whole chunk failed, fall back to
+    single lookups so one bad VIN never fails its neighbours.
+    """
+    vins = list(dict.fromkeys(vins))
+    limit = BULK_PROVIDER.BULK_LIMIT
+    for i in range(0, len(vins), limit):
+        chunk = vins[i:i + limit]
+        try:
+            records = retry(lambda: _decode_chunk(chunk), attempts=2, delay=1, exceptions=(Exception,), quiet=True)
+        except Exception as e:
+            logger.error(f"Bulk decode failed for {len(chunk)} VINs, falling back to single lookups: {e}")
+            records = {}
+
+        for vin in chunk:
+            if vin in records:
+                yield vin, records[vin], None
+                continue
+            try:
+                yield vin, retry(lambda: _decode_shared(vin), attempts=3, delay=2, backoff=2, exceptions=(Exception,), quiet=True), None
+            except Exception as e:
+                yield vin, None, e
+
+## Revalidate a cached record, reusing its payload when the provider reports no change ##
+def revalidate_vin_data(record: VinRecord, limiter: RateLimiter = None) -> VinRecord:
+    refreshed = _decode(record.vin, record=record, limiter=limiter)
+    if refreshed is None:
+        return record.replace(fetched_at=datetime.now().isoformat())
+    return refreshed
 
 ### Recall API Interaction ###
 def get_recall_data(vin: str):
@@ -1,27 +1,40 @@
 from log import logger
-from historyUtils import load_history
+from historyUtils import iter_history, has_history
 from rich import print
 from rich.table import Table as RichTable
 from rich.panel import Panel
 from rich.markup import escape
+from rich.progress import Progress, TextColumn, BarColumn, MofNCompleteColumn, TimeRemainingColumn
 from datetime import datetime
+import sys
+import time
+from vinRecord import VinRecord
+from jobs import list_jobs, finished_unnotified
+from memory import profiled
 
-def print_vin_data(vin: str, data: dict):
-    try:
-        table = RichTable(show_header=True, header_style="bold cyan")
-        table.add_column("Field", style="cyan", no_wrap=True)
-        table.add_column("Value", style="magenta")
+def _vin_panel(vin: str, record: VinRecord):
+    table = RichTable(show_header=True, header_style="bold cyan")
+    table.add_column("Field", style="cyan", no_wrap=True)
+    table.add_column("Value", style="magenta")
 
-        for key, value in data.items():
-            table.add_row(key, str(value))
+    for key, value in record.data.items():
+        table.add_row(key, str(value))
 
-        print(Panel(table, title=f"VIN Data for {vin}", border_style="cyan"))
+    return Panel(table, title=f"VIN Data for {vin}", border_style="cyan")
+
+@profiled("render")
+def print_vin_data(vin: str, record: VinRecord):
+    try:
+        print(_vin_panel(vin, record))
     except Exception as e:
         logger.error(f"Error displaying VIN data: {e}")
         print("[red]Error displaying VIN data.[/red]")
         return
 
-def show_comparison(vin1, data1, vin2, data2):
+@profiled("render")
+def show_comparison(vin1, record1: VinRecord, vin2, record2: VinRecord):
+    data1 = record1.data
+    data2 = record2.data
     table = RichTable(show_header=True, header_style="bold cyan")
     table.add_column("Field", style="cyan", no_wrap=True)
     table.add_column(escape(str(vin1)), style="green")
@@ -58,12 +71,7 @@ def show_recall_table(vin: str, recalls: list):
 
     print(Panel(table, title=f"Safety Recalls for {vin}", border_style="red"))
  
-def show_history():
-    history = load_history()
-    if not history:
-        print("[yellow]No VIN history found.[/yellow]")
-        return
-
+def _history_table(records, title: str):
     table = RichTable(show_header=True, header_style="bold cyan")
     table.add_column("No.", style="cyan", width=4)
     table.add_column("VIN", style="magenta")
@@ -72,13 +80,12 @@ def show_history():
     table.add_column("Year", style="green")
     table.add_column("Date & Time", style="yellow")
 
-    for idx, entry in enumerate(history, start=1):
-        vin = entry.get("vin") or "N/A"
-        data = entry.get("data") or {}
-        make = data.get("brand") or data.get("make") or "N/A"
-        model = data.get("model") or "N/A"
-        year = str(data.get("year") or "N/A")
-        timestamp = entry.get("timestamp") or "N/A"
+    for idx, record in enumerate(records, start=1):
+        vin = record.vin or "N/A"
+        make = record.make or "N/A"
+        model = record.model or "N/A"
+        year = str(record.year or "N/A")
+        timestamp = record.timestamp or "N/A"
 
         # Optionally format timestamp nicely
         try:
@@ -88,7 +95,163 @@ def show_history():
 
         table.add_row(str(idx), vin, make, model, year, timestamp)
 
-    print(Panel(table, title="[bold cyan]VIN Lookup History[/bold cyan]", border_style="cyan"))  
+    return Panel(table, title=f"[bold cyan]{title}[/bold cyan]", border_style="cyan")
+
+@profiled("render")
+def show_history():
+    if not has_history():
+        print("[yellow]No VIN history found.[/yellow]")
+        return
+
+    print(_history_table(iter_history(), "VIN Lookup History"))
+
+@profiled("render")
+def show_query_results(records: list[VinRecord]):
+    if not records:
+        print("[yellow]No history entries match the query.[/yellow]")
+        return
+
+    print(_history_table(records, f"Query Results ({len(records)})"))
+
+### Batch Display ###
+BATCH_VERBOSITY = ("full", "summary", "progress", "none")
+
+class BatchDisplay:
+    """Batch lookup output: a progress bar with throttled throughput, cache and failure counters.
+
+    ``full`` prints a table per fetched VIN, ``summary`` one line per VIN, ``progress`` only
+    the bar and ``none`` nothing until the final summary (used when stdout is not a TTY).
+    """
+
+    REFRESH_INTERVAL = 0.25
+
+    def __init__(self, total: int, verbosity: str = "progress"):
+        if not sys.stdout.isatty():
+            verbosity = "none"
+        self.verbosity = verbosity
+        self.total = total
+        self.cached = 0
+        self.fetched = 0
+        self.failed = 0
+        # Occurrences of a VIN already seen earlier in the batch, served without another lookup
+        self.duplicates = 0
+        self.started = time.perf_counter()
+        self._progress = None
+        self._task = None
+        self._pending = 0
+        self._last_refresh = 0.0
+
+    def __enter__(self):
+        if self.verbosity != "none":
+            self._progress = Progress(
+                TextColumn("[cyan]Processing VINs..."),
+                BarColumn(),
+                MofNCompleteColumn(),
+                TextColumn("{task.fields[stats]}"),
+                TimeRemainingColumn(),
+                refresh_per_second=4,
+            )
+            self._progress.start()
+            self._task = self._progress.add_task("batch", total=self.total, stats="")
+        return self
+
+    def __exit__(self, *exc):
+        self._refresh(force=True)
+        if self._progress is not None:
+            self._progress.stop()
+        return False
+
+    @property
+    def processed(self) -> int:
+        return self.cached + self.fetched + self.failed
+
+    def stats(self) -> str:
+        elapsed = max(time.perf_counter() - self.started, 1e-9)
+        hit_rate = self.cached / self.processed * 100 if self.processed else 0.0
+        duplicate_rate = self.duplicates / self.processed * 100 if self.processed else 0.0
+        return (f"{self.processed / elapsed:.1f} VIN/s | cache hits {hit_rate:.0f}% | "
+                f"duplicates {self.duplicates} ({duplicate_rate:.0f}%) | failed {self.failed}")
+
+    def _refresh(self, force: bool = False):
+        # Counter updates are batched so rendering never runs once per VIN
+        now = time.perf_counter()
+        if self._progress is None or not (force or now - self._last_refresh >= self.REFRESH_INTERVAL):
+            return
+        self._progress.update(self._task, advance=self._pending, stats=self.stats())
+        self._pending = 0
+        self._last_refresh = now
+
+    def _advance(self):
+        self._pending += 1
+        self._refresh()
+
+    def _line(self, message: str):
+        if self.verbosity in ("full", "summary"):
+            self._progress.console.print(message)
+
+    def record_duplicate(self, vin: str):
+        # Counted on top of the cached/fetched/failed outcome the occurrence also gets
+        self.duplicates += 1
+
+    def record_cached(self, vin: str, record: VinRecord):
+        self.cached += 1
+        self._line(f"[green]cached[/green]  {vin}  {record.make or 'N/A'} {record.model or ''} {record.year or ''}")
+        self._advance()
+
+    def record_fetched(self, vin: str, record: VinRecord):
+        self.fetched += 1
+        if self.verbosity == "full":
+            self._progress.console.print(_vin_panel(vin, record))
+        else:
+            self._line(f"[cyan]fetched[/cyan] {vin}  {record.make or 'N/A'} {record.model or ''} {record.year or ''}")
+        self._advance()
+
+    def record_failed(self, vin: str, error):
+        self.failed += 1
+        self._line(f"[red]failed[/red]  {vin}: {escape(str(error))}")
+        self._advance()
+
+### Background Jobs ###
+JOB_STYLES = {"queued": "white", "running": "cyan", "done": "green", "failed": "red", "cancelled": "yellow"}
+
+def _job_progress(job) -> str:
+    if job.total:
+        progress = f"{job.done}/{job.total} ({job.done * 100 // job.total}%)"
+    else:
+        progress = str(job.done) if job.done else "-"
+    return f"{progress} {job.stage}" if job.stage and job.status == "running" else progress
+
+def show_jobs():
+    jobs = list_jobs()
+    if not jobs:
+        print("[yellow]No export jobs yet.[/yellow]")
+        return
+
+    table = RichTable(show_header=True, header_style="bold cyan")
+    table.add_column("ID", style="cyan", width=4)
+    table.add_column("Job", style="magenta")
+    table.add_column("Status")
+    table.add_column("Progress", style="green")
+    table.add_column("Duration", style="yellow")
+    table.add_column("Output")
+
+    for job in jobs:
+        style = JOB_STYLES.get(job.status, "white")
+        output = escape(job.error) if job.status == "failed" else escape(job.output or "-")
+        table.add_row(str(job.id), job.label, f"[{style}]{job.status}[/{style}]",
+                      _job_progress(job), f"{job.duration:.1f}s", output)
+
+    print(Panel(table, title="[bold cyan]Export Jobs[/bold cyan]", border_style="cyan"))
+
+def show_job_notices():
+    # Completion notices for background jobs, shown before a menu is redrawn
+    for job in finished_unnotified():
+        if job.status == "done":
+            print(f"[green]Job {job.id} done:[/green] {job.label} -> {escape(job.output or '')} ({job.duration:.1f}s)")
+        elif job.status == "failed":
+            print(f"[red]Job {job.id} failed:[/red] {job.label}: {escape(job.error or '')}")
+        else:
+            print(f"[yellow]Job {job.id} cancelled:[/yellow] {job.label}")
 
 def show_welcome():
 
@@ -9,20 +9,31 @@ from reportlab.platypus import (
     TableStyle,
 )
 from openpyxl.styles import PatternFill
-from openpyxl import Workbook
+from openpyxl import Workbook, load_workbook
 from openpyxl.styles import Font, Alignment, Border, Side
 from datetime import datetime
+import os
+import csv
+import shutil
+import threading
+import json
 import rich
 from rich import print
 import pandas as pd
 
-from historyUtils import load_history
+import historyStore
+from historyUtils import iter_history, has_history
+from jobs import Job, track
 from log import logger
+from memory import profiled, near_budget, SpilledRecords
+from vinRecord import VinRecord
 
 
 ### Single Export Functions ###
-def export_document(vin: str, data: dict):
+@profiled("export")
+def export_document(vin: str, record: VinRecord):
     try:
+        data = record.data
         date = __import__('datetime').datetime.now().strftime("%Y-%m-%d %H:%M:%S")
         filename = f"{vin}_data.txt"
         with open(filename, 'w') as f:
@@ -35,8 +46,10 @@ def export_document(vin: str, data: dict):
         logger.error(f"Error exporting VIN data to TXT: {e}")
         print("[red]Error exporting VIN data to TXT.[/red]")
         return
-def export_pdf(vin: str, data: dict):
+@profiled("export")
+def export_pdf(vin: str, record: VinRecord):
     filename = f"{vin}_data.pdf"
+    data = record.data
     try: 
         # Create PDF document
         doc = SimpleDocTemplate(
@@ -91,10 +104,30 @@ def export_pdf(vin: str, data: dict):
         print("[red]Error exporting VIN data to PDF.[/red]")
         return   
     
+### Background job helpers ###
+def _begin_job(job: Job, filename: str, records):
+    # Lets the jobs view show the output path and a progress total straight away
+    if job is not None:
+        job.output = os.path.abspath(filename)
+        job.total = len(records)
+def _report(job: Job, message: str):
+    # Jobs are announced from the menu loop rather than printed over the current prompt
+    if job is None:
+        print(message)
+def _page_callbacks(job: Job) -> dict:
+    # reportlab spends most of a large export laying out pages; check for cancellation per page
+    if job is None:
+        return {}
+    def check(canvas, doc):
+        job.check()
+    return {"onFirstPage": check, "onLaterPages": check}
+
 ### Batch Exports ###
-def export_batch_pdf(all_results: list):
+@profiled("export")
+def export_batch_pdf(all_results: list[VinRecord], job: Job = None):
     try:
         filename = f"batch_vin_lookup_{datetime.now().strftime('%Y%m%d_%H%M%S')}.pdf"
+        _begin_job(job, filename, all_results)
         from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table as PDFTable, TableStyle
         from reportlab.lib.styles import getSampleStyleSheet
         from reportlab.lib import colors
@@ -104,9 +137,9 @@ def export_batch_pdf(all_results: list):
 
         story.append(Paragraph(f"<b>Batch VIN Lookup Report</b>", styles["Title"]))
         story.append(Spacer(1, 12))
-        for entry in all_results:
-            vin = entry['vin']
-            data = entry['data']
+        for record in track(all_results, job):
+            vin = record.vin
+            data = record.data
             table_data = [["Field", "Value"]]
             for key, value in data.items():
                 table_data.append([key, str(value)])
@@ -125,95 +158,146 @@ def export_batch_pdf(all_results: list):
             story.append(table)
             story.append(Spacer(1, 12))
 
-        doc.build(story)
-        print(f"[green]All results exported to {filename}[/green]")
+        if job is not None:
+            job.stage = "rendering"
+        doc.build(story, **_page_callbacks(job))
+        _report(job, f"[green]All results exported to {filename}[/green]")
+        return filename
     except Exception as e:
+        if job is not None:
+            raise
         logger.error(f"Error exporting batch PDF: {e}")
         print("[red]Error exporting batch PDF.[/red]")
-def export_batch_txt(all_results: list):
+@profiled("export")
+def export_batch_txt(all_results: list[VinRecord], job: Job = None):
     try:
         filename = f"batch_vin_lookup_{datetime.now().strftime('%Y%m%d_%H%M%S')}.txt"
+        _begin_job(job, filename, all_results)
         with open(filename, 'w') as f:
-            for entry in all_results:
-                vin = entry['vin']
-                data = entry['data']
+            for record in track(all_results, job):
+                vin = record.vin
+                data = record.data
                 f.write(f"VIN: {vin}\n")
                 for key, value in data.items():
                     f.write(f"{key}: {value}\n")
                 f.write("\n")
-        print(f"[green]All results exported to {filename}[/green]")
+        _report(job, f"[green]All results exported to {filename}[/green]")
+        return filename
     except Exception as e:
+        if job is not None:
+            raise
         logger.error(f"Error exporting batch TXT: {e}")
         print("[red]Error exporting batch TXT.[/red]")
-def export_batch_excel(all_results: list):
+@profiled("export")
+def export_batch_excel(all_results: list[VinRecord], job: Job = None):
     try:
 
         filename = f"batch_vin_lookup_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx"
+        _begin_job(job, filename, all_results)
+        if isinstance(all_results, SpilledRecords) or near_budget():
+            # A DataFrame holds every row at once, stream rows into a write-only workbook instead
+            _write_excel_streaming(filename, lambda: iter(all_results), job)
+            _report(job, f"[green]All results exported to {filename}[/green]")
+            return filename
         all_data = []
-        for entry in all_results:
-            vin = entry['vin']
-            data = entry['data']
+        for record in track(all_results, job):
+            vin = record.vin
+            data = record.data
             data_row = {"VIN": vin}
             data_row.update(data)
             all_data.append(data_row)
         df = pd.DataFrame(all_data)
+        if job is not None:
+            job.stage = "writing workbook"
         df.to_excel(filename, index=False)
-        print(f"[green]All results exported to {filename}[/green]")
+        _report(job, f"[green]All results exported to {filename}[/green]")
+        return filename
     except Exception as e:
+        if job is not None:
+            raise
         logger.error(f"Error exporting batch Excel: {e}")
         print("[red]Error exporting batch Excel.[/red]")
     
 ### History Exports ###
-def export_history_to_excel():
-    history = load_history()
-    if not history:
+def _history_source(records):
+    # Query results are exported as given, otherwise the full history is streamed
+    if records is None:
+        return iter_history
+    return lambda: iter(records)
+def _cell_value(value):
+    if value is None or isinstance(value, (str, int, float, bool)):
+        return value
+    return str(value)
+def _write_excel_streaming(filename: str, history, job: Job = None):
+    # Two streaming passes (column set, then rows) so records are never all held in memory
+    columns = {}
+    if job is not None:
+        job.stage = "collecting columns"
+    for record in track(history(), job):
+        columns.update(dict.fromkeys(record.data))
+    if job is not None:
+        job.stage, job.done = "writing rows", 0
+
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet("Sheet1")
+    ws.append(["VIN", *columns])
+    for record in track(history(), job):
+        data = record.data
+        ws.append([record.vin or "N/A", *(_cell_value(data.get(key)) for key in columns)])
+    wb.save(filename)
+@profiled("export")
+def export_history_to_excel(records: list[VinRecord] = None, job: Job = None):
+    history = _history_source(records)
+    if not (records if records is not None else has_history()):
         print("[yellow]No history to export.[/yellow]")
         return
 
     try:
         filename = f"vin_history_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx"
-        all_data = []
-        for entry in history:
-            vin = entry.get("vin") or "N/A"
-            data = entry.get("data") or {}
-            data_row = {"VIN": vin}
-            data_row.update(data)
-            all_data.append(data_row)
-
-        df = pd.DataFrame(all_data)
-        df.to_excel(filename, index=False)
-        print(f"[green]History exported to {filename}[/green]")
+        _begin_job(job, filename, records)
+        _write_excel_streaming(filename, history, job)
+        _report(job, f"[green]History exported to {filename}[/green]")
+        return filename
     except Exception as e:
+        if job is not None:
+            raise
         logger.error(f"Error exporting history to Excel: {e}")
         print("[red]Error exporting history to Excel.[/red]")
-def export_history_to_txt():
-    history = load_history()
-    if not history:
+@profiled("export")
+def export_history_to_txt(records: list[VinRecord] = None, job: Job = None):
+    history = _history_source(records)
+    if not (records if records is not None else has_history()):
         print("[yellow]No history to export.[/yellow]")
         return
 
     try:
         filename = f"vin_history_{datetime.now().strftime('%Y%m%d_%H%M%S')}.txt"
+        _begin_job(job, filename, records)
         with open(filename, 'w') as f:
-            for entry in history:
-                vin = entry.get("vin") or "N/A"
-                data = entry.get("data") or {}
+            for record in track(history(), job):
+                vin = record.vin or "N/A"
+                data = record.data
                 f.write(f"VIN: {vin}\n")
                 for key, value in data.items():
                     f.write(f"{key}: {value}\n")
                 f.write("\n")
-        print(f"[green]History exported to {filename}[/green]")
+        _report(job, f"[green]History exported to {filename}[/green]")
+        return filename
     except Exception as e:
+        if job is not None:
+            raise
         logger.error(f"Error exporting history to TXT: {e}")
         print("[red]Error exporting history to TXT.[/red]")
-def export_history_to_pdf():
-    history = load_history()
-    if not history:
+@profiled("export")
+def export_history_to_pdf(records: list[VinRecord] = None, job: Job = None):
+    history = _history_source(records)
+    if not (records if records is not None else has_history()):
         print("[yellow]No history to export.[/yellow]")
         return
 
     try:
         filename = f"vin_history_{datetime.now().strftime('%Y%m%d_%H%M%S')}.pdf"
+        _begin_job(job, filename, records)
         from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table as PDFTable, TableStyle
         from reportlab.lib.styles import getSampleStyleSheet
         from reportlab.lib import colors
@@ -223,9 +307,9 @@ def export_history_to_pdf():
 
         story.append(Paragraph(f"<b>VIN History Report</b>", styles["Title"]))
         story.append(Spacer(1, 12))
-        for entry in history:
-            vin = entry.get("vin") or "N/A"
-            data = entry.get("data") or {}
+        for record in track(history(), job):
+            vin = record.vin or "N/A"
+            data = record.data
             table_data = [["Field", "Value"]]
             for key, value in data.items():
                 table_data.append([key, str(value)])
@@ -244,14 +328,216 @@ def export_history_to_pdf():
             story.append(table)
             story.append(Spacer(1, 12))
 
-        doc.build(story)
-        print(f"[green]History exported to {filename}[/green]")
+        if job is not None:
+            job.stage = "rendering"
+        doc.build(story, **_page_callbacks(job))
+        _report(job, f"[green]History exported to {filename}[/green]")
+        return filename
     except Exception as e:
+        if job is not None:
+            raise
         logger.error(f"Error exporting history to PDF: {e}")
         print("[red]Error exporting history to PDF.[/red]")
 
+### Incremental History Exports ###
+EXPORT_STATE_PATH = os.path.join(os.getcwd(), "autolookup_export_state.json")
+INCREMENTAL_FORMATS = ("txt", "csv", "ndjson", "xlsx")
+CSV_COLUMNS = ["VIN", "timestamp", "make", "model", "year", "data"]
+_incremental_lock = threading.Lock()
+
+def _load_export_state() -> dict:
+    try:
+        with open(EXPORT_STATE_PATH, "r") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+    except json.JSONDecodeError as e:
+        logger.error(f"Export state file is corrupted, exports will be rebuilt: {e}")
+        return {}
+
+def _save_export_state(state: dict):
+    tmp_path = f"{EXPORT_STATE_PATH}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(state, f, indent=2)
+    os.replace(tmp_path, EXPORT_STATE_PATH)
+
+def _history_since(watermark: dict | None, progress: dict):
+    # Resume from the recorded block offset; if history was rewritten since, fall back to the timestamp
+    generation = historyStore.generation().hex()
+    if watermark and watermark.get("generation") == generation:
+        start, after = watermark.get("offset"), None
+    else:
+        start, after = None, (watermark or {}).get("timestamp")
+
+    progress.update(generation=generation, offset=start, timestamp=(watermark or {}).get("timestamp"))
+    for _, next_offset, entries in historyStore.iter_blocks(start):
+        for entry in entries:
+            timestamp = entry.get("timestamp") or ""
+            if after and timestamp <= after:
+                continue
+            yield VinRecord.from_entry(entry)
+            progress["timestamp"] = max(timestamp, progress["timestamp"] or "")
+        progress["offset"] = next_offset
+
+def _write_txt(path, records, append):
+    count = 0
+    with open(path, "a" if append else "w") as f:
+        for record in records:
+            f.write(f"VIN: {record.vin or 'N/A'}\n")
+            for key, value in record.data.items():
+                f.write(f"{key}: {value}\n")
+            f.write("\n")
+            count += 1
+    return count
+
+def _write_ndjson(path, records, append):
+    count = 0
+    with open(path, "a" if append else "w") as f:
+        for record in records:
+            f.write(json.dumps(record.to_entry(), separators=(",", ":")) + "\n")
+            count += 1
+    return count
+
+def _write_csv(path, records, append):
+    # Fixed columns so appended rows always line up with the header
+    count = 0
+    with open(path, "a" if append else "w", newline="") as f:
+        writer = csv.writer(f)
+        if not append:
+            writer.writerow(CSV_COLUMNS)
+        for record in records:
+            writer.writerow([record.vin, record.timestamp, record.make, record.model, record.year, json.dumps(record.data, separators=(",", ":"))])
+            count += 1
+    return count
+
+def _write_xlsx(path, records, append):
+    if append:
+        wb = load_workbook(path)
+        ws = wb.active
+        columns = {cell.value: idx for idx, cell in enumerate(ws[1]) if cell.value is not None}
+    else:
+        wb = Workbook()
+        ws = wb.active
+        ws.append(["VIN"])
+        columns = {"VIN": 0}
+
+    count = 0
+    for record in records:
+        data = record.data
+        for key in data:
+            # New fields extend the header instead of shifting existing columns
+            if key not in columns:
+                columns[key] = len(columns)
+                ws.cell(row=1, column=len(columns), value=key)
+        row = [None] * len(columns)
+        row[0] = record.vin or "N/A"
+        for key, value in data.items():
+            row[columns[key]] = _cell_value(value)
+        ws.append(row)
+        count += 1
+
+    if count or not append:
+        wb.save(path)
+    return count
+
+_INCREMENTAL_WRITERS = {
+    "txt": _write_txt,
+    "csv": _write_csv,
+    "ndjson": _write_ndjson,
+    "xlsx": _write_xlsx,
+}
+# Formats whose appends only add lines at the end; a workbook is rewritten on every append
+_APPEND_IN_PLACE = ("txt", "csv", "ndjson")
+
+@profiled("export")
+def export_history_incremental(fmt: str, path: str = None, delta: bool = False, full: bool = False, job: Job = None):
+    fmt = fmt.lower()
+    if fmt not in INCREMENTAL_FORMATS:
+        raise ValueError(f"Unsupported incremental export format {fmt!r}, choose from {', '.join(INCREMENTAL_FORMATS)}")
+    if not has_history():
+        _report(job, "[yellow]No history to export.[/yellow]")
+        return None
+
+    path = os.path.abspath(path or f"vin_history.{fmt}")
+    target = f"{fmt}:{path}"
+    # One incremental export at a time, so jobs never race on the watermarks or the same target
+    with _incremental_lock:
+        state = _load_export_state()
+        watermark = None if full else state.get(target)
+
+        if delta:
+            stem, ext = os.path.splitext(path)
+            output = f"{stem}_delta_{datetime.now().strftime('%Y%m%d_%H%M%S')}{ext}"
+            append = False
+        else:
+            output = path
+            # Without the base file there is nothing to append to, so rebuild it
+            if not os.path.exists(path):
+                watermark = None
+            append = watermark is not None
+
+        # Line formats are appended in place and cut back to their old size if the export
+        # fails, so the work stays proportional to the new entries. Other writes go to a
+        # partial file next to the target that replaces it only when complete.
+        in_place = append and fmt in _APPEND_IN_PLACE
+        stem, ext = os.path.splitext(output)
+        partial = output if in_place else f"{stem}.{os.getpid()}.part{ext}"
+        appended_from = os.path.getsize(output) if in_place else None
+        if job is not None:
+            # A cancelled job removes its output file, which must never be the target itself
+            job.output = None if in_place else partial
+            job.stage = "appending" if append else "writing"
+        try:
+            if append and not in_place:
+                shutil.copyfile(output, partial)
+            progress = {}
+            count = _INCREMENTAL_WRITERS[fmt](partial, track(_history_since(watermark, progress), job), append)
+            if job is not None:
+                job.check()
+            if not in_place:
+                if count or not (append or delta):
+                    os.replace(partial, output)
+                else:
+                    os.remove(partial)
+        except Exception as e:
+            if in_place:
+                os.truncate(output, appended_from)
+            elif os.path.exists(partial):
+                os.remove(partial)
+            if job is not None:
+                raise
+            logger.error(f"Error in incremental {fmt} export to {output}: {e}")
+            print(f"[red]Error exporting history to {fmt.upper()}.[/red]")
+            return None
+        if job is not None:
+            job.output = output
+
+        state[target] = {
+            "generation": progress["generation"],
+            "offset": progress["offset"],
+            "timestamp": progress["timestamp"],
+            "exported_at": datetime.now().isoformat(),
+        }
+        _save_export_state(state)
+
+    if count == 0 and append:
+        _report(job, f"[yellow]No new history entries since the last export to {output}.[/yellow]")
+        return None
+    if delta and count == 0:
+        _report(job, "[yellow]No new history entries since the last export.[/yellow]")
+        if job is not None:
+            job.output = None
+        return None
+
+    logger.info(f"Incremental {fmt} export wrote {count} entries to {output} (append={append}, delta={delta})")
+    _report(job, f"[green]{count} history entries {'appended to' if append else 'exported to'} {output}[/green]")
+    return output
+
 ### Comparison Exports ###
-def export_comparison_excel(vin1_data: dict, vin2_data: dict, vin1: str, vin2: str):
+@profiled("export")
+def export_comparison_excel(record1: VinRecord, record2: VinRecord, vin1: str, vin2: str):
+    vin1_data = record1.data
+    vin2_data = record2.data
     try:
         filename = f"vin_comparison_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx"
         wb = Workbook()
@@ -326,7 +612,10 @@ def export_comparison_excel(vin1_data: dict, vin2_data: dict, vin1: str, vin2: s
         print(f"[red]Error exporting Excel comparison: {e}[/red]")
     except Exception as e:
         print(f"[red]Error exporting comparison Excel: {e}[/red]")
-def export_comparison_txt(vin1_data: dict, vin2_data: dict, vin1: str, vin2: str):
+@profiled("export")
+def export_comparison_txt(record1: VinRecord, record2: VinRecord, vin1: str, vin2: str):
+    vin1_data = record1.data
+    vin2_data = record2.data
     filename = f"VIN_comparison_{vin1}_{vin2}.txt"
     with open(filename, "w") as f:
         f.write(f"VIN Comparison: {vin1} vs {vin2}\n\n")
@@ -336,7 +625,10 @@ def export_comparison_txt(vin1_data: dict, vin2_data: dict, vin1: str, vin2: str
             val2 = vin2_data.get(key, "N/A")
             f.write(f"{key}: {val1} | {val2}\n")
     print(f"[green]Comparison exported to {filename}[/green]")
-def export_comparison_pdf(vin1_data: dict, vin2_data: dict, vin1: str, vin2: str):
+@profiled("export")
+def export_comparison_pdf(record1: VinRecord, record2: VinRecord, vin1: str, vin2: str):
+    vin1_data = record1.data
+    vin2_data = record2.data
     try:
         filename = f"vin_comparison_{datetime.now().strftime('%Y%m%d_%H%M%S')}.pdf"
         doc = SimpleDocTemplate(filename, pagesize=letter, rightMargin=30, leftMargin=30, topMargin=30, bottomMargin=18)
@@ -0,0 +1,249 @@
+import os
+import sys
+import json
+import struct
+import threading
+from array import array
+from datetime import datetime
+import historyStore
+from log import logger
+from vinRecord import VinRecord
+
+# Persisted secondary indexes, refreshed incrementally from the end of the history data file
+QUERY_INDEX_PATH = os.path.join(os.getcwd(), "autolookup_history.qidx")
+QUERY_INDEX_VERSION = 2
+# File layout: magic, JSON header length, JSON header (labels, posting keys, array
+# lengths), then the raw arrays. Plain data only, nothing in it is ever executed.
+QUERY_INDEX_MAGIC = b"ALQ2"
+HEADER_LENGTH = struct.Struct(">I")
+COLUMNS = ("block_offsets", "entry_slots", "timestamps", "years", "makes", "models")
+POSTINGS = ("by_make", "by_model", "by_year", "by_wmi")
+SORT_FIELDS = ("timestamp", "make", "model", "year")
+
+_index_lock = threading.Lock()
+_index = None
+
+### Secondary Indexes ###
+class HistoryIndex:
+    """Column arrays for every history entry plus posting lists per make, model, year and WMI.
+
+    Row ``i`` is entry ``entry_slots[i]`` of the block at ``block_offsets[i]``.
+    """
+
+    def __init__(self, generation: bytes):
+        self.version = QUERY_INDEX_VERSION
+        self.generation = generation
+        self.scanned_to = None
+        self.block_offsets = array("Q")
+        self.entry_slots = array("H")
+        self.timestamps = array("d")
+        self.years = array("H")
+        self.makes = array("I")
+        self.models = array("I")
+        self.labels = [""]  # label id -> original text, 0 means missing
+        self.label_ids = {"": 0}
+        self.by_make = {}
+        self.by_model = {}
+        self.by_year = {}
+        self.by_wmi = {}
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    def _label(self, value) -> int:
+        value = str(value or "")
+        label_id = self.label_ids.get(value)
+        if label_id is None:
+            label_id = self.label_ids[value] = len(self.labels)
+            self.labels.append(value)
+        return label_id
+
+    def add(self, offset: int, slot: int, entry: dict):
+        record = VinRecord.from_entry(entry)
+        row = len(self)
+        self.block_offsets.append(offset)
+        self.entry_slots.append(slot)
+        self.timestamps.append(_epoch(record.timestamp))
+        self.years.append(record.year if record.year and 0 < record.year < 65536 else 0)
+        self.makes.append(self._label(record.make))
+        self.models.append(self._label(record.model))
+
+        if record.make:
+            self.by_make.setdefault(_key(record.make), array("I")).append(row)
+        if record.model:
+            self.by_model.setdefault(_key(record.model), array("I")).append(row)
+        if record.year:
+            self.by_year.setdefault(record.year, array("I")).append(row)
+        if record.vin and len(record.vin) >= 3:
+            self.by_wmi.setdefault(record.vin[:3], array("I")).append(row)
+
+    def sort_key(self, field: str):
+        if field == "timestamp":
+            return self.timestamps.__getitem__
+        if field == "year":
+            return self.years.__getitem__
+        column = self.makes if field == "make" else self.models
+        return lambda row: self.labels[column[row]].lower()
+
+def _key(value) -> str:
+    return str(value).strip().lower()
+
+def _epoch(timestamp) -> float:
+    try:
+        return datetime.fromisoformat(timestamp).timestamp()
+    except (TypeError, ValueError):
+        return 0.0
+
+def _load_index():
+    try:
+        with open(QUERY_INDEX_PATH, "rb") as f:
+            if f.read(len(QUERY_INDEX_MAGIC)) != QUERY_INDEX_MAGIC:
+                raise ValueError("not a query index file")
+            (length,) = HEADER_LENGTH.unpack(f.read(HEADER_LENGTH.size))
+            header = json.loads(f.read(length))
+            if header.get("version") != QUERY_INDEX_VERSION:
+                return None
+
+            index = HistoryIndex(bytes.fromhex(header["generation"]))
+            index.scanned_to = header["scanned_to"]
+            index.labels = header["labels"]
+            index.label_ids = {label: label_id for label_id, label in enumerate(index.labels)}
+            swap = header["byteorder"] != sys.byteorder
+
+            def read_array(typecode, count):
+                values = array(typecode)
+                if values.itemsize != header["itemsizes"][typecode]:
+                    raise ValueError(f"array item size for {typecode!r} differs on this platform")
+                values.fromfile(f, count)
+                if swap:
+                    values.byteswap()
+                return values
+
+            for name in COLUMNS:
+                column = getattr(index, name)
+                setattr(index, name, read_array(column.typecode, header["columns"][name]))
+            for name in POSTINGS:
+                postings = getattr(index, name)
+                for key, count in header["postings"][name]:
+                    postings[key] = read_array("I", count)
+        return index
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        logger.warning(f"Ignoring unreadable history query index: {e}")
+    return None
+
+def _save_index(index: HistoryIndex):
+    typecodes = {getattr(index, name).typecode for name in COLUMNS} | {"I"}
+    header = {
+        "version": index.version,
+        "generation": index.generation.hex(),
+        "scanned_to": index.scanned_to,
+        "byteorder": sys.byteorder,
+        "itemsizes": {typecode: array(typecode).itemsize for typecode in typecodes},
+        "labels": index.labels,
+        "columns": {name: len(getattr(index, name)) for name in COLUMNS},
+        "postings": {name: [[key, len(rows)] for key, rows in getattr(index, name).items()] for name in POSTINGS},
+    }
+    encoded = json.dumps(header, separators=(",", ":")).encode("utf-8")
+
+    tmp_path = f"{QUERY_INDEX_PATH}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(QUERY_INDEX_MAGIC + HEADER_LENGTH.pack(len(encoded)) + encoded)
+        for name in COLUMNS:
+            getattr(index, name).tofile(f)
+        for name in POSTINGS:
+            for rows in getattr(index, name).values():
+                rows.tofile(f)
+    os.replace(tmp_path, QUERY_INDEX_PATH)
+
+def get_index() -> HistoryIndex | None:
+    global _index
+    generation = historyStore.generation()
+    if generation is None:
+        return None
+
+    with _index_lock:
+        if _index is None:
+            _index = _load_index()
+        if _index is None or _index.generation != generation:
+            # History was rewritten (delete/clear), start over
+            _index = HistoryIndex(generation)
+
+        # Only blocks appended since the last refresh are decoded
+        added = 0
+        for offset, next_offset, entries in historyStore.iter_blocks(_index.scanned_to):
+            for slot, entry in enumerate(entries):
+                _index.add(offset, slot, entry)
+            _index.scanned_to = next_offset
+            added += len(entries)
+
+        if added:
+            logger.info(f"History query index updated with {added} entries ({len(_index)} total)")
+            try:
+                _save_index(_index)
+            except Exception as e:
+                logger.warning(f"Failed to persist history query index: {e}")
+        return _index
+
+### Query API ###
+def query_history(make: str = None, model: str = None, year: int = None, wmi: str = None,
+                  since: datetime = None, until: datetime = None,
+                  sort_by: str = "timestamp", descending: bool = True, limit: int = None) -> list[VinRecord]:
+    if sort_by not in SORT_FIELDS:
+        raise ValueError(f"Cannot sort history by {sort_by!r}, choose from {', '.join(SORT_FIELDS)}")
+
+    index = get_index()
+    if index is None:
+        return []
+
+    # Intersect posting lists, smallest first
+    postings = []
+    if make:
+        postings.append(index.by_make.get(_key(make), ()))
+    if model:
+        postings.append(index.by_model.get(_key(model), ()))
+    if year:
+        postings.append(index.by_year.get(int(year), ()))
+    if wmi:
+        postings.append(index.by_wmi.get(wmi.strip().upper()[:3], ()))
+
+    if postings:
+        postings.sort(key=len)
+        rows = set(postings[0])
+        for posting in postings[1:]:
+            if not rows:
+                break
+            rows.intersection_update(posting)
+    else:
+        rows = range(len(index))
+
+    if since or until:
+        low = since.timestamp() if since else float("-inf")
+        high = until.timestamp() if until else float("inf")
+        timestamps = index.timestamps
+        rows = [row for row in rows if low <= timestamps[row] <= high]
+
+    # Append order is already chronological, so timestamp sorts only need a reversal
+    if sort_by == "timestamp" and not postings and not (since or until):
+        rows = range(len(index) - 1, -1, -1) if descending else range(len(index))
+    else:
+        rows = sorted(rows, key=index.sort_key(sort_by), reverse=descending)
+
+    if limit:
+        rows = rows[:limit]
+    return _materialize(index, rows)
+
+def _materialize(index: HistoryIndex, rows) -> list[VinRecord]:
+    # Decompress each needed block once, then return records in query order
+    blocks = {}
+    records = []
+    for row in rows:
+        offset = index.block_offsets[row]
+        if offset not in blocks:
+            blocks[offset] = historyStore.read_block(offset)
+        entries = blocks[offset]
+        slot = index.entry_slots[row]
+        if slot < len(entries):
+            records.append(VinRecord.from_entry(entries[slot]))
+    return records
@@ -0,0 +1,432 @@
+import io
+import os
+import json
+import mmap
+import uuid
+import zlib
+import struct
+import threading
+from contextlib import contextmanager
+from log import logger
+from vinRecord import VinRecord
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+# On-disk history layout
+#   .dat      header (magic + generation id) followed by zlib-compressed NDJSON blocks
+#   .idx      header (magic + generation id) followed by VIN -> block offset records sorted by VIN
+#   .idx.log  unsorted VIN -> block offset records appended since the last compaction
+#   .commit   generation id + length of the data file that readers may see
+#   .lock     held by writers; readers never take it
+DATA_PATH = os.path.join(os.getcwd(), "autolookup_history.dat")
+INDEX_PATH = os.path.join(os.getcwd(), "autolookup_history.idx")
+JOURNAL_PATH = INDEX_PATH + ".log"
+COMMIT_PATH = DATA_PATH + ".commit"
+LOCK_PATH = os.path.join(os.getcwd(), "autolookup_history.lock")
+
+DATA_MAGIC = b"ALH1"
+INDEX_MAGIC = b"ALI1"
+HEADER_SIZE = len(DATA_MAGIC) + 16
+BLOCK_HEADER = struct.Struct(">II")  # compressed length, entry count
+INDEX_RECORD = struct.Struct(">17sQ")  # VIN, block offset
+BLOCK_ENTRIES = 64  # entries per block when the store is rewritten
+JOURNAL_LIMIT = 4096  # journal records before they are merged into the sorted index
+COMPRESSION_LEVEL = 6
+COMMIT_RECORD = struct.Struct(">16sQ")  # generation, committed data length
+
+_index_map = None
+_index_stat = None
+# Guards the shared index map: held while a lookup reads it and while it is replaced
+_index_lock = threading.Lock()
+_thread_lock = threading.RLock()
+_lock_depth = 0
+_lock_file = None
+
+### Cross-process write lock ###
+def _lock_exclusive(f):
+    if fcntl is not None:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        return
+    f.seek(0)
+    while True:
+        try:
+            msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+            return
+        except OSError:
+            continue  # LK_LOCK gives up after ~10 s, keep waiting
+
+def _unlock(f):
+    if fcntl is not None:
+        fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+    else:
+        f.seek(0)
+        msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+@contextmanager
+def lock():
+    # Re-entrant within a process, exclusive across processes sharing the working directory
+    global _lock_depth, _lock_file
+    with _thread_lock:
+        if _lock_depth == 0:
+            _lock_file = open(LOCK_PATH, "a+b")
+            _lock_exclusive(_lock_file)
+        _lock_depth += 1
+        try:
+            yield
+        finally:
+            _lock_depth -= 1
+            if _lock_depth == 0:
+                _unlock(_lock_file)
+                _lock_file.close()
+                _lock_file = None
+
+def _replace_file(path: str, content: bytes):
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(content)
+    os.replace(tmp_path, path)
+
+### Encoding helpers ###
+def _vin_key(vin):
+    if not vin or len(vin) != 17:
+        return None
+    try:
+        return vin.encode("ascii")
+    except UnicodeEncodeError:
+        return None
+
+def _encode_block(records: list[VinRecord]) -> bytes:
+    lines = "\n".join(json.dumps(record.to_entry(), separators=(",", ":")) for record in records)
+    payload = zlib.compress(lines.encode("utf-8"), COMPRESSION_LEVEL)
+    return BLOCK_HEADER.pack(len(payload), len(records)) + payload
+
+def _decode_block(payload: bytes) -> list[dict]:
+    text = zlib.decompress(payload).decode("utf-8")
+    return [json.loads(line) for line in text.split("\n") if line]
+
+def _generation(path, magic):
+    try:
+        with open(path, "rb") as f:
+            header = f.read(HEADER_SIZE)
+    except FileNotFoundError:
+        return None
+    if len(header) != HEADER_SIZE or header[:len(magic)] != magic:
+        return None
+    return header[len(magic):]
+
+def exists() -> bool:
+    return _generation(DATA_PATH, DATA_MAGIC) is not None
+
+def generation() -> bytes | None:
+    return _generation(DATA_PATH, DATA_MAGIC)
+
+def _committed_length(data_generation: bytes) -> int | None:
+    # None when the commit record is missing or belongs to another generation
+    try:
+        with open(COMMIT_PATH, "rb") as f:
+            commit_generation, length = COMMIT_RECORD.unpack(f.read(COMMIT_RECORD.size))
+    except (FileNotFoundError, struct.error):
+        return None
+    return length if commit_generation == data_generation else None
+
+def _write_commit(data_generation: bytes, length: int):
+    _replace_file(COMMIT_PATH, COMMIT_RECORD.pack(data_generation, length))
+
+### Reading ###
+def _read_blocks(f, start=HEADER_SIZE, end=None):
+    # Yields (offset, next_offset, entries) for each complete block; a torn tail is ignored
+    offset = start
+    f.seek(offset)
+    while end is None or offset < end:
+        header = f.read(BLOCK_HEADER.size)
+        if len(header) < BLOCK_HEADER.size:
+            return
+        length, _ = BLOCK_HEADER.unpack(header)
+        payload = f.read(length)
+        if len(payload) < length:
+            return
+        try:
+            entries = _decode_block(payload)
+        except (zlib.error, ValueError) as e:
+            logger.error(f"Skipping unreadable history block at offset {offset}: {e}")
+            entries = []
+        next_offset = offset + BLOCK_HEADER.size + length
+        yield offset, next_offset, entries
+        offset = next_offset
+
+def iter_blocks(start: int = None):
+    if not exists():
+        return
+    with open(DATA_PATH, "rb") as f:
+        # Stop at the committed length so an append in progress is never read half written
+        end = _committed_length(f.read(HEADER_SIZE)[len(DATA_MAGIC):])
+        yield from _read_blocks(f, start=start or HEADER_SIZE, end=end)
+
+def iter_entries():
+    for _, _, entries in iter_blocks():
+        yield from entries
+
+def iter_records():
+    for entry in iter_entries():
+        yield VinRecord.from_entry(entry)
+
+def read_block(offset: int) -> list[dict]:
+    with open(DATA_PATH, "rb") as f:
+        for _, _, entries in _read_blocks(f, start=offset):
+            return entries
+    return []
+
+class Snapshot:
+    """Point-in-time view of the history, for long reads such as background exports.
+
+    Reads stop at the length committed when the snapshot was taken, and the open
+    handle keeps that data readable even if a rewrite replaces the file.
+    """
+
+    def __init__(self):
+        self._file = open(DATA_PATH, "rb")
+        self.generation = self._file.read(HEADER_SIZE)[len(DATA_MAGIC):]
+        self.end = _committed_length(self.generation) or os.fstat(self._file.fileno()).st_size
+        if os.name == "nt":
+            # Windows cannot replace a file that is still open, so copy the compressed blocks instead
+            self._file.seek(0)
+            data = self._file.read(self.end)
+            self._file.close()
+            self._file = io.BytesIO(data)
+        self._count = None
+
+    def __len__(self):
+        # Entry counts are in the block headers, no decompression needed
+        if self._count is None:
+            self._count = 0
+            offset = HEADER_SIZE
+            while offset < self.end:
+                self._file.seek(offset)
+                header = self._file.read(BLOCK_HEADER.size)
+                if len(header) < BLOCK_HEADER.size:
+                    break
+                length, count = BLOCK_HEADER.unpack(header)
+                self._count += count
+                offset += BLOCK_HEADER.size + length
+        return self._count
+
+    def __iter__(self):
+        for _, _, entries in _read_blocks(self._file, start=HEADER_SIZE, end=self.end):
+            for entry in entries:
+                yield VinRecord.from_entry(entry)
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def snapshot() -> Snapshot | None:
+    if not exists():
+        return None
+    return Snapshot()
+
+### Index lookups ###
+def _release_index():
+    # Caller holds _index_lock; Windows cannot replace a file that is still mapped
+    global _index_map, _index_stat
+    if _index_map is not None:
+        _index_map.close()
+    _index_map = _index_stat = None
+
+def _mapped_index():
+    # Caller holds _index_lock, so no other thread is reading the map it may close
+    global _index_map, _index_stat
+    try:
+        stat = os.stat(INDEX_PATH)
+    except FileNotFoundError:
+        return None
+    key = (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+    if _index_map is None or _index_stat != key:
+        _release_index()
+        if stat.st_size <= HEADER_SIZE:
+            _index_stat = key
+            return None
+        with open(INDEX_PATH, "rb") as f:
+            _index_map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        _index_stat = key
+    return _index_map
+
+def _index_lookup(key: bytes):
+    with _index_lock:
+        mapped = _mapped_index()
+        if mapped is None:
+            return None
+        low, high = 0, (len(mapped) - HEADER_SIZE) // INDEX_RECORD.size
+        while low < high:
+            mid = (low + high) // 2
+            start = HEADER_SIZE + mid * INDEX_RECORD.size
+            vin = mapped[start:start + 17]
+            if vin < key:
+                low = mid + 1
+            elif vin > key:
+                high = mid
+            else:
+                return INDEX_RECORD.unpack_from(mapped, start)[1]
+        return None
+
+def _read_journal() -> bytes:
+    try:
+        with open(JOURNAL_PATH, "rb") as f:
+            data = f.read()
+    except FileNotFoundError:
+        return b""
+    return data[:len(data) - len(data) % INDEX_RECORD.size]
+
+def _journal_lookup(key: bytes):
+    journal = _read_journal()
+    # Newest records are at the end of the journal
+    for start in range(len(journal) - INDEX_RECORD.size, -1, -INDEX_RECORD.size):
+        if journal[start:start + 17] == key:
+            return INDEX_RECORD.unpack_from(journal, start)[1]
+    return None
+
+def find_latest(vin: str) -> VinRecord | None:
+    key = _vin_key(vin)
+    if key is None or not exists():
+        return None
+    if _generation(INDEX_PATH, INDEX_MAGIC) != _generation(DATA_PATH, DATA_MAGIC):
+        with lock():
+            # Another writer may have fixed it while we waited
+            if _generation(INDEX_PATH, INDEX_MAGIC) != _generation(DATA_PATH, DATA_MAGIC):
+                rebuild_index()
+
+    offset = _journal_lookup(key)
+    if offset is None:
+        offset = _index_lookup(key)
+    if offset is None:
+        return None
+
+    for entry in reversed(read_block(offset)):
+        if entry.get("vin") == vin:
+            return VinRecord.from_entry(entry)
+    return None
+
+### Writing ###
+def _write_index(generation: bytes, offsets: dict):
+    tmp_path = f"{INDEX_PATH}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(INDEX_MAGIC + generation)
+        for key in sorted(offsets):
+            f.write(INDEX_RECORD.pack(key, offsets[key]))
+    with _index_lock:
+        _release_index()
+        os.replace(tmp_path, INDEX_PATH)
+    if os.path.exists(JOURNAL_PATH):
+        os.remove(JOURNAL_PATH)
+
+def _index_offsets() -> dict:
+    offsets = {}
+    with _index_lock:
+        mapped = _mapped_index()
+        if mapped is not None:
+            for start in range(HEADER_SIZE, len(mapped), INDEX_RECORD.size):
+                key, offset = INDEX_RECORD.unpack_from(mapped, start)
+                offsets[key] = offset
+    journal = _read_journal()
+    for start in range(0, len(journal), INDEX_RECORD.size):
+        key, offset = INDEX_RECORD.unpack_from(journal, start)
+        offsets[key] = max(offset, offsets.get(key, 0))
+    return offsets
+
+def compact_index():
+    with lock():
+        _write_index(_generation(DATA_PATH, DATA_MAGIC), _index_offsets())
+
+def rebuild_index():
+    logger.warning("History index missing or out of date. Rebuilding from history data.")
+    offsets = {}
+    with open(DATA_PATH, "rb") as f:
+        for offset, _, entries in _read_blocks(f):
+            for entry in entries:
+                key = _vin_key(entry.get("vin"))
+                if key is not None:
+                    offsets[key] = offset
+    _write_index(_generation(DATA_PATH, DATA_MAGIC), offsets)
+
+def _recover_length(data_generation: bytes) -> int:
+    # Stores written before commit records existed, or a lost commit file: trust complete blocks
+    end = HEADER_SIZE
+    with open(DATA_PATH, "rb") as f:
+        for _, next_offset, _ in _read_blocks(f):
+            end = next_offset
+    _write_commit(data_generation, end)
+    return end
+
+def append_records(records: list[VinRecord]):
+    if not records:
+        return
+    block = _encode_block(records)
+
+    with lock():
+        if not exists():
+            rewrite([])
+        data_generation = generation()
+        offset = _committed_length(data_generation)
+        if offset is None:
+            offset = _recover_length(data_generation)
+
+        with open(DATA_PATH, "r+b") as f:
+            # Anything past the committed length is a torn write from a crashed writer
+            f.truncate(offset)
+            f.seek(offset)
+            f.write(block)
+        _write_commit(data_generation, offset + len(block))
+
+        journal = b"".join(
+            INDEX_RECORD.pack(key, offset)
+            for key in {_vin_key(record.vin) for record in records}
+            if key is not None
+        )
+        with open(JOURNAL_PATH, "ab") as f:
+            f.write(journal)
+            journal_size = f.tell()
+
+        if journal_size // INDEX_RECORD.size >= JOURNAL_LIMIT:
+            compact_index()
+
+def rewrite(records):
+    # Replaces the whole store under a new generation id
+    with lock():
+        data_generation = uuid.uuid4().bytes
+        offsets = {}
+        tmp_path = f"{DATA_PATH}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(DATA_MAGIC + data_generation)
+            chunk = []
+            for record in records:
+                chunk.append(record)
+                if len(chunk) == BLOCK_ENTRIES:
+                    _write_chunk(f, chunk, offsets)
+                    chunk = []
+            _write_chunk(f, chunk, offsets)
+            length = f.tell()
+
+        # Old journal offsets must never be applied to the new data file
+        if os.path.exists(JOURNAL_PATH):
+            os.remove(JOURNAL_PATH)
+        _write_commit(data_generation, length)
+        os.replace(tmp_path, DATA_PATH)
+        _write_index(data_generation, offsets)
+
+def _write_chunk(f, chunk, offsets):
+    if not chunk:
+        return
+    offset = f.tell()
+    f.write(_encode_block(chunk))
+    for record in chunk:
+        key = _vin_key(record.vin)
+        if key is not None:
+            offsets[key] = offset
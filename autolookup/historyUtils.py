@@ -1,67 +1,214 @@
 import os
 import json
-import logging
+import queue
+import atexit
+import threading
 from datetime import datetime
+from rich import print
+import historyStore
+from api import revalidate_vin_data, RateLimiter
 from log import logger
+from memory import profiled
+from vinRecord import VinRecord
 
 
+# Legacy pretty-printed JSON history, migrated into historyStore on first use
 HISTORY_PATH = os.path.join(os.getcwd(), "autolookup_history.json")
-## save VIN lookup to history ##
-def save_vin_lookup(data):
-    history = load_history()
+# Cached entries older than this (seconds) are served but refreshed in the background
+CACHE_MAX_AGE = int(os.environ.get("AUTOLOOKUP_CACHE_MAX_AGE", 7 * 24 * 60 * 60))
+# Background refreshes: queued VINs beyond the limit are skipped until their next stale hit
+REFRESH_QUEUE_LIMIT = int(os.environ.get("AUTOLOOKUP_REFRESH_QUEUE", "256"))
+REFRESH_RATE = float(os.environ.get("AUTOLOOKUP_REFRESH_RATE", "2"))  # revalidations per second
+REFRESH_WORKERS = 2
+REFRESH_SAVE_CHUNK = 50
 
-    entry = {
-        "timestamp": datetime.now().isoformat(),
-        "vin": data.get("vin"),
-        "data": data
-    }
+_refresh_lock = threading.Lock()
+_refresh_queue = queue.Queue(maxsize=REFRESH_QUEUE_LIMIT)
+_refresh_limiter = RateLimiter(REFRESH_RATE)
+_refreshing = set()  # queued, in flight, or refreshed but not saved yet
+_refreshed = []
+_refresh_workers = []
+## migrate legacy JSON history into the compressed store ##
+def migrate_legacy_history():
+    if historyStore.exists() or not os.path.exists(HISTORY_PATH):
+        return
+    try:
+        with historyStore.lock():
+            # Another process may have migrated it while we waited
+            if historyStore.exists() or not os.path.exists(HISTORY_PATH):
+                return
+            with open(HISTORY_PATH, "r") as f:
+                content = f.read().strip()
+            entries = json.loads(content) if content else []
+            historyStore.rewrite(VinRecord.from_entry(entry) for entry in entries)
+            os.replace(HISTORY_PATH, HISTORY_PATH + ".migrated")
+        logger.info(f"Migrated {len(entries)} history entries to {historyStore.DATA_PATH}")
+    except Exception as e:
+        # The legacy file is left untouched so nothing is lost
+        logger.exception("Failed to migrate legacy history file:")
+        print(f"[red]Failed to migrate legacy history file: {e}[/red]")
+## save VIN lookup to history ##
+def save_vin_lookup(record):
+    save_vin_lookups([record])
+def save_vin_lookups(records, source: str = None):
+    # source tags entries not saved by a user lookup, so they do not count as lookups
+    timestamp = datetime.now().isoformat()
+    stamped = []
+    for record in records:
+        if not isinstance(record, VinRecord):
+            record = VinRecord.from_payload(record)
+        # Cached records keep their original fetch time so staleness is not reset by re-saving
+        stamped.append(record.replace(timestamp=timestamp, fetched_at=record.fetched_at or timestamp, source=source))
 
-    history.append(entry)
-    save_history(history)
-## load VIN history ##
-def load_history():
-    if not os.path.exists(HISTORY_PATH):
+    try:
+        migrate_legacy_history()
+        historyStore.append_records(stamped)
+    except Exception as e:
+        logger.exception("Failed to save VIN history:")
+        print(f"[red]Failed to save to history: {e}[/red]")
+## stream VIN history block by block ##
+def iter_history():
+    migrate_legacy_history()
+    if not historyStore.exists():
         logger.info("History file not found. Creating new one.")
         print("[yellow]No history file found. A new one will be created upon first save.[/yellow]")
-        return []
+        return
 
     try:
-        with open(HISTORY_PATH, "r") as f:
-            content = f.read().strip()
-
-            if not content:
-                logger.warning("History file is empty.")
-                return []
-
-            return json.loads(content)
-
-    except json.JSONDecodeError as e:
-        logger.error(f"History file is corrupted: {e}")
-        print("[red]History file is corrupted. Starting with an empty history.[/red]")
-        return []
-
+        yield from historyStore.iter_records()
     except Exception as e:
         logger.exception("Unexpected error while loading history:")
         print(f"[red]Unexpected error loading history: {e}[/red]")
-        return []   
+def history_snapshot():
+    # Point-in-time view for background exports, None when there is no history
+    migrate_legacy_history()
+    return historyStore.snapshot()
+## load VIN history ##
+@profiled("load")
+def load_history() -> list[VinRecord]:
+    return list(iter_history())
+def has_history() -> bool:
+    migrate_legacy_history()
+    return next(historyStore.iter_entries(), None) is not None
 ## save VIN history ##
-def save_history(history):
+def save_history(history: list[VinRecord]):
     try:
-        with open(HISTORY_PATH, "w") as f:
-            json.dump(history, f, indent=2)
+        historyStore.rewrite(history)
         logger.info("History saved successfully.")
     except Exception as e:
         logger.exception("Failed to save VIN history:")
         print(f"[red]Failed to save to history: {e}[/red]")
-    history = load_history()
+## delete one history entry by its 1-based position in the history table ##
+def remove_history_entry(position: int) -> VinRecord | None:
+    migrate_legacy_history()
+    # Held across read and rewrite so entries saved by other sessions meanwhile are kept
+    with historyStore.lock():
+        snapshot = historyStore.snapshot()
+        if snapshot is None:
+            return None
+        with snapshot:
+            # Counted from block headers and streamed into the rewrite, never loaded as a whole
+            if not 1 <= position <= len(snapshot):
+                return None
+            deleted = []
+
+            def kept():
+                for number, record in enumerate(snapshot, 1):
+                    if number == position:
+                        deleted.append(record)
+                    else:
+                        yield record
+
+            save_history(kept())
+        return deleted[0] if deleted else None
+## cache freshness ##
+def is_fresh(record: VinRecord, max_age: int = None) -> bool:
+    max_age = CACHE_MAX_AGE if max_age is None else max_age
+    try:
+        fetched_at = datetime.fromisoformat(record.fetched_at)
+    except (TypeError, ValueError):
+        return False
+    return (datetime.now() - fetched_at).total_seconds() <= max_age
+
+## background revalidation of stale entries ##
+def queue_refresh(record: VinRecord):
+    with _refresh_lock:
+        if record.vin in _refreshing:
+            return
+        try:
+            _refresh_queue.put_nowait(record)
+        except queue.Full:
+            logger.info(f"Refresh queue full, skipping background refresh for VIN: {record.vin}")
+            return
+        _refreshing.add(record.vin)
+        # Daemon threads, so a pending refresh never holds up exit
+        while len(_refresh_workers) < REFRESH_WORKERS:
+            worker = threading.Thread(target=_refresh_worker, name="vin-refresh", daemon=True)
+            worker.start()
+            _refresh_workers.append(worker)
+
+def _refresh_worker():
+    while True:
+        record = _refresh_queue.get()
+        try:
+            refreshed = revalidate_vin_data(record, _refresh_limiter)
+            with _refresh_lock:
+                _refreshed.append(refreshed)
+                full = len(_refreshed) >= REFRESH_SAVE_CHUNK
+            logger.info(f"Refreshed stale cached data for VIN: {record.vin}")
+        except Exception as e:
+            logger.error(f"Background refresh failed for VIN {record.vin}: {e}")
+            with _refresh_lock:
+                _refreshing.discard(record.vin)
+            full = False
+        # Refreshed records are saved together, one history block per chunk
+        if full or _refresh_queue.empty():
+            flush_refreshes()
+
+def flush_refreshes():
+    with _refresh_lock:
+        records = list(_refreshed)
+        _refreshed.clear()
+    if not records:
+        return
+    save_vin_lookups(records, source="refresh")
+    with _refresh_lock:
+        _refreshing.difference_update(record.vin for record in records)
+
+def stop_refreshes():
+    # Pending refreshes are dropped; ones already refreshed are still saved
+    dropped = 0
+    while True:
+        try:
+            record = _refresh_queue.get_nowait()
+        except queue.Empty:
+            break
+        dropped += 1
+        with _refresh_lock:
+            _refreshing.discard(record.vin)
+    if dropped:
+        logger.info(f"Cancelled {dropped} pending background refreshes")
+    flush_refreshes()
+
+atexit.register(stop_refreshes)
+
 ## get cached VIN data ##
-def get_cached_vin(vin: str) -> dict | None:
-    history = load_history()  # Your existing function
-    for entry in reversed(history):  # Search latest first
-        if entry.get("vin") == vin:
+def get_cached_vin(vin: str, quiet: bool = False) -> VinRecord | None:
+    migrate_legacy_history()
+    # The index points straight at the block holding the latest entry for this VIN
+    record = historyStore.find_latest(vin)
+    if record is None:
+        return None
+    if is_fresh(record):
+        if not quiet:
             print(f"[green]Found cached data for VIN: {vin}[/green]")
-            logger.info(f"Using cached data for VIN: {vin}")
-            return entry.get("data")
-    return None
+        logger.info(f"Using cached data for VIN: {vin}")
+    else:
+        # Serve stale data now, refresh it for the next lookup
+        if not quiet:
+            print(f"[yellow]Cached data for VIN {vin} is stale, refreshing in the background.[/yellow]")
+        logger.info(f"Using stale cached data for VIN: {vin}, refresh queued")
+        queue_refresh(record)
+    return record
 
 
@@ -1,17 +1,44 @@
 import os
+from collections import Counter
 
 from rich import print
 from rich.panel import Panel
 from rich.prompt import Prompt
-from rich.progress import Progress
 from rich.table import Table as RichTable
 
-from api import get_vin_data, get_recall_data, validate_vin, retry, VINDataError
-from historyUtils import save_vin_lookup, get_cached_vin
-from manageHistory import manage_history
+from api import get_vin_data, get_recall_data, validate_vin, retry, decode_vins_bulk, VINDataError, BULK_DECODE, VIN_LOOKUPS
+from historyUtils import save_vin_lookup, save_vin_lookups, get_cached_vin
+from manageHistory import manage_history, start_export_job, export_and_close, jobs_prompt, finish_jobs_before_exit
 from exports import export_batch_txt, export_batch_pdf, export_batch_excel, export_document, export_pdf, export_comparison_txt, export_comparison_pdf, export_comparison_excel
-from display import print_vin_data, show_history, show_comparison, show_recall_table
+from display import print_vin_data, show_history, show_comparison, show_recall_table, show_job_notices, BatchDisplay
 from log import logger
+from memory import stage, near_budget, SpillingResults, SpilledRecords
+from vinRecord import VinRecord
+
+SAVE_CHUNK = 50
+BUDGET_CHECK_EVERY = 256  # VINs between memory budget checks
+
+def _fetch_uncached(vins: list[str]):
+    # Bulk POST requests by default, otherwise one request per distinct VIN
+    if BULK_DECODE:
+        yield from decode_vins_bulk(vins)
+        return
+    for vin in dict.fromkeys(vins):
+        try:
+            yield vin, retry(lambda: get_vin_data(vin, show_spinner=False), attempts=3, delay=2, backoff=2, exceptions=(Exception,), quiet=True), None
+        except Exception as e:
+            yield vin, None, e
+
+def _start_batch_export(label: str, export, all_results):
+    # Spilled results stay on disk until the export job is done with them
+    if isinstance(all_results, SpilledRecords):
+        return start_export_job(label, export_and_close, export, all_results)
+    return start_export_job(label, export, all_results)
+
+def _spill_near_budget(results: SpillingResults, position: int):
+    # Checked every few hundred VINs; once spilled, records are no longer kept in memory
+    if position % BUDGET_CHECK_EVERY == 0 and not results.spilled and near_budget():
+        results.spill()
 
 ## Input fields / prompts ##
 def batch_vin_prompt():
@@ -28,54 +55,99 @@ def batch_vin_prompt():
         print("[red]No VINs found in the file.[/red]")
         return
 
-    all_results = []
-    failed_vins = []
+    verbosity = Prompt.ask(
+        "[bold yellow]Display: full tables (full) / one line per VIN (summary) / progress only (progress)[/bold yellow]",
+        choices=["full", "summary", "progress"],
+        default="progress",
+    )
 
-    with Progress() as progress:
-        task = progress.add_task("[cyan]Processing VINs...", total=len(vins))
-
-        for vin in vins:
-            cached_data = get_cached_vin(vin)
-            if cached_data:
-                print(f"[green]Using cached data for VIN: {vin}[/green]")
-                data = cached_data
-                all_results.append({"vin": vin, "data": data})
-                progress.update(task, advance=1)
-                continue
-            else:
+    # Records move to a private spill file if the memory budget forces them out of memory
+    results = SpillingResults()
+    ordered_vins = []
+    uncached = []
+    failed_vins = []
+    occurrences = Counter()
+    lookups_before, shared_before = VIN_LOOKUPS.stats()
+
+    with BatchDisplay(len(vins), verbosity) as display:
+        with stage("load"):
+            # Cache hits are served locally first, the rest are fetched together
+            for position, vin in enumerate(vins):
+                _spill_near_budget(results, position)
                 try:
                     vin = validate_vin(vin)
-                    data = retry(lambda: get_vin_data(vin), attempts=3, delay=2, backoff=2, exceptions=(Exception,))
-                    print_vin_data(vin, data)
-                    save_vin_lookup(data)
-                    all_results.append({"vin": vin, "data": data})
                 except VINDataError as e:
-                    print(f"[red]Invalid VIN {vin}: {e}[/red]")
                     logger.warning(f"Invalid VIN during batch lookup: {vin} - {e}")
                     failed_vins.append(vin)
-                except Exception as e:
-                    print(f"[red]Error fetching data for {vin}: {e}[/red]")
-                    logger.error(f"Error fetching data for VIN {vin}: {e}")
-                    failed_vins.append(vin)
-
-            progress.update(task, advance=1)
-
-    print(f"\n[bold green]Batch lookup completed![/bold green] {len(all_results)} successful, {len(failed_vins)} failed.\n")
-    logger.info(f"Batch lookup complete. Success: {len(all_results)}, Failed: {len(failed_vins)}")
+                    display.record_failed(vin, e)
+                    continue
+
+                ordered_vins.append(vin)
+                # Repeats share the first occurrence's cache lookup or fetch
+                if vin in occurrences:
+                    display.record_duplicate(vin)
+                    occurrences[vin] += 1
+                    continue
+                if vin in results:
+                    display.record_duplicate(vin)
+                    display.record_cached(vin, results[vin])
+                    continue
+                cached_data = get_cached_vin(vin, quiet=True)
+                if cached_data:
+                    results[vin] = cached_data
+                    display.record_cached(vin, cached_data)
+                else:
+                    uncached.append(vin)
+                    occurrences[vin] += 1
+
+        with stage("fetch"):
+            to_save = []
+            for position, (vin, data, error) in enumerate(_fetch_uncached(uncached)):
+                _spill_near_budget(results, position)
+                if data is not None:
+                    results[vin] = data
+                    to_save.append(data)
+                    # Save in chunks so history gets one block per request batch
+                    if len(to_save) >= SAVE_CHUNK:
+                        save_vin_lookups(to_save)
+                        to_save = []
+                else:
+                    logger.error(f"Error fetching data for VIN {vin}: {error}")
+
+                for _ in range(occurrences[vin]):
+                    if data is not None:
+                        display.record_fetched(vin, data)
+                    else:
+                        failed_vins.append(vin)
+                        display.record_failed(vin, error)
+            save_vin_lookups(to_save)
+
+    all_results = results.ordered(ordered_vins)
+
+    print(f"\n[bold green]Batch lookup completed![/bold green] {len(all_results)} successful, {len(failed_vins)} failed.")
+    lookups, shared = VIN_LOOKUPS.stats()
+    lookup_stats = f"{len(set(ordered_vins))} distinct of {len(ordered_vins)} valid VINs, {len(uncached)} fetched"
+    if lookups > lookups_before:
+        lookup_stats += f", {shared - shared_before} of {lookups - lookups_before} single lookups shared an in-flight fetch"
+    print(f"[cyan]{display.stats()}[/cyan]")
+    print(f"[cyan]{lookup_stats}[/cyan]\n")
+    logger.info(f"Batch lookup complete. Success: {len(all_results)}, Failed: {len(failed_vins)}, {display.stats()}, {lookup_stats}")
 
     # Ask user to export all results
     export_choice = Prompt.ask("[bold yellow]Export all results? TXT (T) / PDF (P) / EXCEL (E) / Skip (S)[/bold yellow]").strip().upper()
 
+    # Exports run as background jobs; the results are not touched again here
     if export_choice == 'T':
-        export_batch_txt(all_results)
+        _start_batch_export(f"Batch TXT ({len(all_results)} VINs)", export_batch_txt, all_results)
         return
     elif export_choice == 'P':
-        export_batch_pdf(all_results)
+        _start_batch_export(f"Batch PDF ({len(all_results)} VINs)", export_batch_pdf, all_results)
         return
     elif export_choice == 'E':
-        export_batch_excel(all_results)
+        _start_batch_export(f"Batch Excel ({len(all_results)} VINs)", export_batch_excel, all_results)
         return
     else:
+        results.close()
         print("[yellow]Export skipped.[/yellow]")
 
     if failed_vins:
@@ -132,13 +204,14 @@ def compare_vins_prompt():
         print(f"[red]Invalid VIN:[/red] {e}")
         return compare_vins_prompt()
 
-    # Fetch data from cache or API
+    # Fetch data from cache or API; the same VIN twice is looked up once
     data1 = get_cached_vin(vin1) or retry(lambda: get_vin_data(vin1), attempts=3)
-    data2 = get_cached_vin(vin2) or retry(lambda: get_vin_data(vin2), attempts=3)
+    data2 = data1 if vin2 == vin1 else get_cached_vin(vin2) or retry(lambda: get_vin_data(vin2), attempts=3)
 
     # Save to history/cache
     save_vin_lookup(data1)
-    save_vin_lookup(data2)
+    if vin2 != vin1:
+        save_vin_lookup(data2)
 
     show_comparison(vin1, data1, vin2, data2)
     # Export option
@@ -151,7 +224,7 @@ def compare_vins_prompt():
         export_comparison_excel(data1, data2, vin1, vin2)
 
 ## Input sections / menus ##
-def after_lookup(vin: str, data: dict):
+def after_lookup(vin: str, data: VinRecord):
     while True:
         menu_text = """
         [bold cyan]Export TXT[/bold cyan]  - Press [bold]D[/bold]
@@ -161,6 +234,7 @@ def after_lookup(vin: str, data: dict):
         [bold green]New Lookup / Main menu[/bold green] - Press [bold]N[/bold]
         [bold red]Exit[/bold red] - Press [bold]E[/bold]
         """
+        show_job_notices()
         print(Panel.fit(menu_text, border_style="white", padding=(1, 3)))
 
         choice = Prompt.ask("[bold yellow]Please enter your choice[/bold yellow]").strip().upper()
@@ -180,6 +254,7 @@ def after_lookup(vin: str, data: dict):
             recalls = retry(lambda: get_recall_data(vin), attempts=3, delay=2, backoff=2, exceptions=(Exception,))
             show_recall_table(vin, recalls)
         elif choice == 'E':
+            finish_jobs_before_exit()
             print("[green]Exiting VIN CLI. Goodbye![/green]")
             exit()
 
@@ -196,9 +271,11 @@ def initOptions():
 
         [bold cyan]View History[/bold cyan] - Press [bold]H[/bold]
         [bold cyan]Manage history (export/delete) [/bold cyan] - Press [bold]M[/bold]
+        [bold cyan]Export jobs[/bold cyan] - Press [bold]J[/bold]
 
         [bold red]Exit[/bold red] - Press [bold]E[/bold]
         """
+        show_job_notices()
         print(Panel.fit(options_text, border_style="cyan", padding=(1, 3)))
         choice = Prompt.ask("[bold yellow]Please enter your choice[/bold yellow]").strip().upper()
         if choice == 'N':
@@ -211,7 +288,10 @@ def initOptions():
             batch_vin_prompt()
         elif choice == 'M':
             manage_history()
+        elif choice == 'J':
+            jobs_prompt()
         elif choice == 'E':
+            finish_jobs_before_exit()
             print("[green]Exiting VIN CLI. Goodbye![/green]")
             exit()
         else:
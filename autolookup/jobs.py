@@ -0,0 +1,131 @@
+import os
+import time
+import itertools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from log import logger
+
+# Exports run here so menus return immediately
+EXPORT_WORKERS = int(os.getenv("AUTOLOOKUP_EXPORT_WORKERS", "2"))
+
+_pool = ThreadPoolExecutor(max_workers=EXPORT_WORKERS, thread_name_prefix="export")
+_jobs_lock = threading.Lock()
+_jobs = []
+_ids = itertools.count(1)
+
+class JobCancelled(Exception):
+    pass
+
+### Background Job ###
+class Job:
+    """A background export with progress, timing, output path and cancellation."""
+
+    def __init__(self, label: str):
+        self.id = next(_ids)
+        self.label = label
+        self.status = "queued"  # queued, running, done, failed, cancelled
+        self.stage = ""
+        self.done = 0
+        self.total = None
+        self.output = None
+        self.error = None
+        self.submitted_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.notified = False
+        self._cancel = threading.Event()
+
+    @property
+    def active(self) -> bool:
+        return self.status in ("queued", "running")
+
+    @property
+    def duration(self) -> float:
+        if self.started_at is None:
+            return 0.0
+        return (self.finished_at or time.time()) - self.started_at
+
+    def cancel(self) -> bool:
+        if not self.active:
+            return False
+        self._cancel.set()
+        return True
+
+    def check(self):
+        # Called from the export loop; raises so the export unwinds at a safe point
+        if self._cancel.is_set():
+            raise JobCancelled()
+
+    def __repr__(self):
+        return f"Job(id={self.id}, label={self.label!r}, status={self.status!r})"
+
+def track(records, job: Job = None):
+    """Iterate ``records``, counting progress and honouring cancellation when run as a job."""
+    if job is None:
+        yield from records
+        return
+    for record in records:
+        job.check()
+        yield record
+        job.done += 1
+
+def _run(job: Job, func, args, kwargs):
+    job.started_at = time.time()
+    if job._cancel.is_set():
+        job.finished_at, job.status = job.started_at, "cancelled"
+        return
+    job.status = "running"
+    try:
+        output = func(*args, job=job, **kwargs)
+        job.output = os.path.abspath(output) if output else job.output
+        status = "done"
+        logger.info(f"Job {job.id} ({job.label}) finished in {job.duration:.1f}s: {job.output}")
+    except JobCancelled:
+        status = "cancelled"
+        logger.info(f"Job {job.id} ({job.label}) cancelled after {job.done} records")
+        # Drop the partial file
+        if job.output and os.path.exists(job.output):
+            os.remove(job.output)
+    except Exception as e:
+        status = "failed"
+        job.error = str(e)
+        logger.exception(f"Job {job.id} ({job.label}) failed:")
+    # Finish time first, so a job is never seen as finished without one
+    job.finished_at = time.time()
+    job.status = status
+
+def submit(label: str, func, *args, **kwargs) -> Job:
+    """Run ``func(*args, job=job, **kwargs)`` on the export pool and return its job."""
+    job = Job(label)
+    with _jobs_lock:
+        _jobs.append(job)
+    _pool.submit(_run, job, func, args, kwargs)
+    logger.info(f"Job {job.id} ({label}) submitted")
+    return job
+
+def list_jobs() -> list[Job]:
+    with _jobs_lock:
+        return list(_jobs)
+
+def get_job(job_id: int) -> Job | None:
+    with _jobs_lock:
+        return next((job for job in _jobs if job.id == job_id), None)
+
+def active_jobs() -> list[Job]:
+    return [job for job in list_jobs() if job.active]
+
+def finished_unnotified() -> list[Job]:
+    # Each finished job is announced once, the next time a menu is drawn
+    with _jobs_lock:
+        finished = [job for job in _jobs if not job.active and not job.notified]
+        for job in finished:
+            job.notified = True
+    return finished
+
+def cancel_all():
+    for job in active_jobs():
+        job.cancel()
+
+def wait_all():
+    while active_jobs():
+        time.sleep(0.2)
@@ -1,28 +1,80 @@
-from exports import (export_history_to_excel, export_history_to_txt, export_history_to_pdf)
-from historyUtils import load_history, save_history
+from exports import (export_history_to_excel, export_history_to_txt, export_history_to_pdf,
+                     export_history_incremental, INCREMENTAL_FORMATS)
+from historyUtils import has_history, save_history, remove_history_entry, history_snapshot
 from rich import print
 from rich.panel import Panel
 from rich.prompt import Prompt
-from display import show_history
+from datetime import datetime
+from display import show_history, show_query_results, show_jobs, show_job_notices
+from historyQuery import query_history, SORT_FIELDS
+from jobs import submit, get_job, active_jobs, cancel_all, wait_all
 from log import logger
 
+# Run an export on the background job pool so the menu returns immediately
+def start_export_job(label: str, export, *args):
+    job = submit(label, export, *args)
+    print(f"[cyan]Started job {job.id}: {label}. Track it under Jobs (J).[/cyan]")
+    return job
+
+# Export a snapshot or spilled batch results, then release the files behind them
+def export_and_close(export, records, job):
+    with records:
+        return export(records, job=job)
+
+# Export the history as it is now; lookups made meanwhile are not included
+def export_history_job(export, label: str):
+    snapshot = history_snapshot()
+    if snapshot is None or not len(snapshot):
+        print("[yellow]No history to export.[/yellow]")
+        return
+    start_export_job(f"{label} ({len(snapshot)} entries)", export_and_close, export, snapshot)
+
+# View and cancel background export jobs
+def jobs_prompt():
+    while True:
+        show_jobs()
+        choice = Prompt.ask("[bold yellow]Refresh (R) / Cancel a job (enter its ID) / Back (B)[/bold yellow]", default="B").strip().upper()
+        if choice == 'B':
+            return
+        if choice == 'R':
+            continue
+        try:
+            job = get_job(int(choice))
+        except ValueError:
+            print("[red]Invalid choice. Please try again.[/red]")
+            continue
+        if job is None:
+            print("[red]No job with that ID.[/red]")
+        elif job.cancel():
+            print(f"[yellow]Cancelling job {job.id}...[/yellow]")
+        else:
+            print(f"[yellow]Job {job.id} already {job.status}.[/yellow]")
+
+# Called before exiting so running exports are not cut off silently
+def finish_jobs_before_exit():
+    running = active_jobs()
+    if not running:
+        return
+    choice = Prompt.ask(f"[bold yellow]{len(running)} export job(s) still running. Wait for them (W) / Cancel them (C)[/bold yellow]",
+                        choices=["W", "C"], default="W")
+    if choice == "C":
+        cancel_all()
+    wait_all()
+    show_job_notices()
+
 # Delete history entry
 def delete_history_entry():
-    history = load_history()
-        
-    if not history:
+    if not has_history():
         print("[yellow]No history to delete.[/yellow]")
         logger.info("No history available for deletion.")
         return
 
     entry_no = Prompt.ask("[bold yellow]Enter the entry number to delete[/bold yellow]").strip()
     try:
-        entry_idx = int(entry_no) - 1
-        if 0 <= entry_idx < len(history):
-            deleted_entry = history.pop(entry_idx)
-            save_history(history)
-            print(f"[green]Deleted entry for VIN: {deleted_entry.get('vin')}[/green]")
-            logger.info(f"Deleted history entry for VIN: {deleted_entry.get('vin')}")
+        deleted_entry = remove_history_entry(int(entry_no))
+        if deleted_entry is not None:
+            print(f"[green]Deleted entry for VIN: {deleted_entry.vin}[/green]")
+            logger.info(f"Deleted history entry for VIN: {deleted_entry.vin}")
         else:
             print("[red]Invalid entry number.[/red]")
     except ValueError:
@@ -38,35 +90,97 @@ def clear_history():
     else:
         print("[yellow]Clear history cancelled.[/yellow]")
 
+# Query history by make, model, year, WMI and date range
+def query_history_prompt():
+    print("[cyan]Leave a filter blank to skip it.[/cyan]")
+    make = Prompt.ask("[bold yellow]Make[/bold yellow]", default="").strip()
+    model = Prompt.ask("[bold yellow]Model[/bold yellow]", default="").strip()
+    year = Prompt.ask("[bold yellow]Year[/bold yellow]", default="").strip()
+    wmi = Prompt.ask("[bold yellow]WMI (first 3 VIN characters)[/bold yellow]", default="").strip()
+    since = Prompt.ask("[bold yellow]From date (YYYY-MM-DD)[/bold yellow]", default="").strip()
+    until = Prompt.ask("[bold yellow]To date (YYYY-MM-DD)[/bold yellow]", default="").strip()
+    sort_by = Prompt.ask("[bold yellow]Sort by[/bold yellow]", choices=list(SORT_FIELDS), default="timestamp")
+    limit = Prompt.ask("[bold yellow]Max results[/bold yellow]", default="100").strip()
+
+    try:
+        records = query_history(
+            make=make or None,
+            model=model or None,
+            year=int(year) if year else None,
+            wmi=wmi or None,
+            since=datetime.fromisoformat(since) if since else None,
+            # Include the whole end day
+            until=datetime.fromisoformat(until).replace(hour=23, minute=59, second=59) if until else None,
+            sort_by=sort_by,
+            limit=int(limit) if limit else None,
+        )
+    except ValueError as e:
+        print(f"[red]Invalid query: {e}[/red]")
+        return
+
+    logger.info(f"History query make={make} model={model} year={year} wmi={wmi} from={since} to={until}: {len(records)} results")
+    show_query_results(records)
+    if not records:
+        return
+
+    export_choice = Prompt.ask("[bold yellow]Export results? TXT (T) / PDF (P) / EXCEL (E) / Skip (S)[/bold yellow]").strip().upper()
+    if export_choice == 'T':
+        start_export_job(f"Query results TXT ({len(records)} entries)", export_history_to_txt, records)
+    elif export_choice == 'P':
+        start_export_job(f"Query results PDF ({len(records)} entries)", export_history_to_pdf, records)
+    elif export_choice == 'E':
+        start_export_job(f"Query results Excel ({len(records)} entries)", export_history_to_excel, records)
+    else:
+        print("[yellow]Export skipped.[/yellow]")
+
+# Export only entries added since the last export to the same file
+def incremental_export_prompt():
+    fmt = Prompt.ask("[bold yellow]Format[/bold yellow]", choices=list(INCREMENTAL_FORMATS), default="csv")
+    path = Prompt.ask("[bold yellow]Target file[/bold yellow]", default=f"vin_history.{fmt}").strip()
+    mode = Prompt.ask("[bold yellow]Append to file (A) / Write delta file (D) / Full rebuild (F)[/bold yellow]", choices=["A", "D", "F"], default="A")
+    label = {"A": "append", "D": "delta", "F": "full rebuild"}[mode]
+    start_export_job(f"Incremental {fmt.upper()} export ({label})", export_history_incremental,
+                     fmt, path, mode == "D", mode == "F")
+
 # Manage history (export/delete)
 def manage_history():
      while True:
         options_text = """
         [bold cyan]View history[/bold cyan] - Press [bold]V[/bold]
+        [bold cyan]Query history[/bold cyan] - Press [bold]Q[/bold]
         [bold cyan]Delete entry[/bold cyan] - Press [bold]D[/bold]
         [bold cyan]Clear all history[/bold cyan] - Press [bold]C[/bold]
         [bold green]Export to excel[/bold green] - Press [bold]E[/bold]
         [bold white]Export to .txt[/bold white] - Press [bold]T[/bold]
         [bold red]Export to pdf (export/delete) [/bold red] - Press [bold]P[/bold]
+        [bold magenta]Incremental export (new entries only)[/bold magenta] - Press [bold]I[/bold]
+        [bold cyan]Export jobs[/bold cyan] - Press [bold]J[/bold]
 
         [bold yellow]Back to Main Menu[/bold yellow] - Press [bold]B[/bold]
          
         """
+        show_job_notices()
         print(Panel.fit(options_text, border_style="cyan", padding=(1, 3)))
         choice = Prompt.ask("[bold yellow]Please enter your choice[/bold yellow]").strip().upper()
 
         if choice == 'V':
             show_history()
+        elif choice == 'Q':
+            query_history_prompt()
         elif choice == 'D':
             delete_history_entry()
         elif choice == 'C':
             clear_history()
         elif choice == 'E':
-            export_history_to_excel()
+            export_history_job(export_history_to_excel, "History Excel")
         elif choice == 'T':
-            export_history_to_txt()
+            export_history_job(export_history_to_txt, "History TXT")
         elif choice == 'P':
-            export_history_to_pdf()
+            export_history_job(export_history_to_pdf, "History PDF")
+        elif choice == 'I':
+            incremental_export_prompt()
+        elif choice == 'J':
+            jobs_prompt()
         elif choice == 'B':
             return
         else:
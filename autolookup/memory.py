@@ -0,0 +1,315 @@
+import os
+import sys
+import json
+import time
+import atexit
+import threading
+import weakref
+import tempfile
+import functools
+import tracemalloc
+from contextlib import contextmanager
+from rich import print
+from log import logger
+from vinRecord import VinRecord
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# Opt-in allocation profiling, per-stage peaks and a top-allocators report written at exit
+MEMORY_PROFILE = os.environ.get("AUTOLOOKUP_MEMORY_PROFILE", "0") == "1"
+MEMORY_REPORT_PATH = os.path.join(os.getcwd(), "autolookup_memory_report.txt")
+# Memory budget in MB (0 disables it); runs start spilling results at BUDGET_WARN_FRACTION of it
+MEMORY_BUDGET_MB = float(os.environ.get("AUTOLOOKUP_MEMORY_BUDGET", "0"))
+BUDGET_WARN_FRACTION = 0.8
+TOP_ALLOCATORS = 15
+STAGE_TOP_ALLOCATORS = 5
+
+_lock = threading.Lock()
+_open = set()  # names of the stages currently running in any thread
+_active = []  # their runs
+_stats = {}  # stage name -> StageStats
+_budget_warned = False
+# The profiler's own bookkeeping and module imports would otherwise top every list
+_NOISE = (
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+    tracemalloc.Filter(False, "<unknown>"),
+)
+
+class StageStats:
+    """Accumulated allocation figures for one stage across all of its runs."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.runs = 0
+        self.seconds = 0.0
+        self.peak = 0  # highest traced memory seen while the stage ran
+        self.growth = 0  # that peak minus traced memory when the run started
+        self.retained = 0  # net allocations still alive when runs ended
+        self.top = []  # biggest allocation growth lines from the run with the highest peak
+
+class _Run:
+    def __init__(self, name: str):
+        self.name = name
+        self.peak = 0
+        self.started = time.perf_counter()
+        self.start_memory = tracemalloc.get_traced_memory()[0]
+        self.start_snapshot = _snapshot()
+
+def _snapshot():
+    return tracemalloc.take_snapshot().filter_traces(_NOISE)
+
+def _fold_peak():
+    # tracemalloc has one global peak; hand it to every running stage before it is reset
+    peak = tracemalloc.get_traced_memory()[1]
+    for run in _active:
+        run.peak = max(run.peak, peak)
+    tracemalloc.reset_peak()
+
+### Profiling ###
+def enable_profiling():
+    global MEMORY_PROFILE
+    MEMORY_PROFILE = True
+    if not tracemalloc.is_tracing():
+        tracemalloc.start()
+        atexit.register(write_report)
+        logger.info("Memory profiling enabled")
+
+@contextmanager
+def stage(name: str):
+    """Record peak and retained allocations while the block runs (no-op unless profiling).
+
+    A stage that is already open anywhere in the process is not re-entered, so nested calls
+    such as lookups on prefetch worker threads while ``prefetch`` holds "fetch" count once
+    and take no snapshots of their own; two export jobs at once likewise make one run.
+    Different stages running in other threads overlap in time and each sees the
+    process-wide peak.
+    """
+    if not (MEMORY_PROFILE and tracemalloc.is_tracing()):
+        yield
+        return
+    with _lock:
+        nested = name in _open
+        if not nested:
+            _open.add(name)
+            _fold_peak()
+            run = _Run(name)
+            _active.append(run)
+    if nested:
+        yield
+        return
+
+    try:
+        yield
+    finally:
+        with _lock:
+            _fold_peak()
+            _active.remove(run)
+            _open.discard(name)
+            end_memory = tracemalloc.get_traced_memory()[0]
+            stats = _stats.setdefault(name, StageStats(name))
+            stats.runs += 1
+            stats.seconds += time.perf_counter() - run.started
+            stats.retained += end_memory - run.start_memory
+            if run.peak >= stats.peak:
+                stats.peak = run.peak
+                stats.growth = run.peak - run.start_memory
+                diff = _snapshot().compare_to(run.start_snapshot, "lineno")
+                stats.top = [str(line) for line in diff if line.size_diff > 0][:STAGE_TOP_ALLOCATORS]
+
+def profiled(name: str):
+    """Decorator form of ``stage``."""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with stage(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def _mb(size: float) -> str:
+    return f"{size / (1024 * 1024):.1f} MB"
+
+def write_report(path: str = None):
+    if not tracemalloc.is_tracing():
+        return
+    path = path or MEMORY_REPORT_PATH
+    current, peak = tracemalloc.get_traced_memory()
+    lines = [
+        f"AutoLookup memory report ({time.strftime('%Y-%m-%d %H:%M:%S')})",
+        f"Traced now {_mb(current)}, traced peak since last stage {_mb(peak)}, process RSS {_mb(memory_usage() or 0)}",
+        "",
+        "Peak is traced memory at the stage's highest point, Growth how much of it the stage added,",
+        "Retained what its runs left allocated when they finished.",
+        "",
+        f"{'Stage':<10} {'Runs':>6} {'Seconds':>9} {'Peak':>12} {'Growth':>12} {'Retained':>12}",
+    ]
+    for stats in sorted(_stats.values(), key=lambda s: s.growth, reverse=True):
+        lines.append(f"{stats.name:<10} {stats.runs:>6} {stats.seconds:>9.2f} {_mb(stats.peak):>12} "
+                     f"{_mb(stats.growth):>12} {_mb(stats.retained):>12}")
+    for stats in _stats.values():
+        lines += ["", f"New allocations still alive at the end of the {stats.name} run with the highest peak:", *stats.top]
+    lines += ["", "Top allocators still alive at exit:"]
+    lines += [str(stat) for stat in _snapshot().statistics("lineno")[:TOP_ALLOCATORS]]
+
+    with open(path, "w") as f:
+        f.write("\n".join(lines) + "\n")
+    logger.info(f"Memory report written to {path}")
+    print(f"[cyan]Memory report written to {path}[/cyan]")
+
+### Memory Budget ###
+def set_budget(megabytes: float):
+    global MEMORY_BUDGET_MB
+    MEMORY_BUDGET_MB = megabytes
+
+def memory_usage() -> int | None:
+    # Resident set size in bytes; the peak RSS where the current value is not available
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        pass
+    if resource is not None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024
+    if tracemalloc.is_tracing():
+        return tracemalloc.get_traced_memory()[0]
+    return None
+
+def near_budget() -> bool:
+    """True once memory use reaches BUDGET_WARN_FRACTION of the budget; warns the first time."""
+    global _budget_warned
+    if MEMORY_BUDGET_MB <= 0:
+        return False
+    usage = memory_usage()
+    limit = MEMORY_BUDGET_MB * 1024 * 1024
+    if usage is None or usage < limit * BUDGET_WARN_FRACTION:
+        return False
+    if not _budget_warned:
+        _budget_warned = True
+        logger.warning(f"Memory use {_mb(usage)} is near the {MEMORY_BUDGET_MB:g} MB budget, spilling results to disk")
+        print(f"[yellow]Memory use {_mb(usage)} is near the {MEMORY_BUDGET_MB:g} MB budget; results will be kept on disk.[/yellow]")
+    return True
+
+class SpillingResults:
+    """VIN -> record map that stops holding records once the memory budget is near.
+
+    After ``spill`` records are written to a private temporary file and read back by offset,
+    so later lookups or refreshes saving newer history entries cannot change what was
+    collected. ``close`` removes the file.
+    """
+
+    def __init__(self):
+        self._records = {}  # VIN -> record, or its offset in the spill file once spilled
+        self._file = None
+        self._lock = threading.Lock()
+        self.spilled = False
+        self.path = None
+
+    def __contains__(self, vin):
+        return vin in self._records
+
+    def __len__(self):
+        return len(self._records)
+
+    def __setitem__(self, vin, record):
+        if not self.spilled:
+            self._records[vin] = record
+            return
+        with self._lock:
+            self._records[vin] = self._write(record)
+            self._file.flush()
+
+    def __getitem__(self, vin):
+        record = self._records[vin]
+        if not self.spilled:
+            return record
+        with self._lock:
+            return self._read(self._file, vin, record)
+
+    def get(self, vin, default=None):
+        return self[vin] if vin in self._records else default
+
+    def _write(self, record) -> int:
+        self._file.seek(0, os.SEEK_END)
+        offset = self._file.tell()
+        self._file.write(json.dumps(record.to_entry(), separators=(",", ":")).encode() + b"\n")
+        return offset
+
+    def _read(self, f, vin: str, offset: int):
+        # A record that cannot be read back is an error, never a silently shorter export
+        try:
+            f.seek(offset)
+            entry = json.loads(f.readline())
+        except (OSError, ValueError) as e:
+            raise OSError(f"Spilled result for VIN {vin} could not be read back from {self.path}: {e}") from e
+        return VinRecord.from_entry(entry)
+
+    def spill(self):
+        if self.spilled:
+            return
+        fd, self.path = tempfile.mkstemp(prefix="autolookup_spill_", suffix=".ndjson")
+        self._file = os.fdopen(fd, "w+b")
+        self._finalizer = weakref.finalize(self, _remove_spill, self._file, self.path)
+        with self._lock:
+            for vin, record in self._records.items():
+                self._records[vin] = self._write(record)
+            self._file.flush()
+        self.spilled = True
+        logger.info(f"Moved {len(self._records)} in-memory results to {self.path}")
+
+    def open_reader(self):
+        # A separate handle, so an export job can iterate while the batch still reads results
+        return open(self.path, "rb")
+
+    def close(self):
+        if self.spilled:
+            self._finalizer()
+
+    def ordered(self, vins: list[str]):
+        """Records for ``vins`` in order: a list while in memory, a lazy re-readable view once spilled."""
+        vins = [vin for vin in vins if vin in self._records]
+        if not self.spilled:
+            return [self._records[vin] for vin in vins]
+        return SpilledRecords(vins, self)
+
+def _remove_spill(f, path: str):
+    f.close()
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+class SpilledRecords:
+    """Sequence of spilled records read back one at a time on every iteration.
+
+    Closing it (or leaving its ``with`` block) removes the spill file.
+    """
+
+    def __init__(self, vins: list[str], results: SpillingResults):
+        self._vins = vins
+        self._results = results
+
+    def __len__(self):
+        return len(self._vins)
+
+    def __iter__(self):
+        with self._results.open_reader() as f:
+            for vin in self._vins:
+                yield self._results._read(f, vin, self._results._records[vin])
+
+    def close(self):
+        self._results.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+if MEMORY_PROFILE:
+    enable_profiling()
@@ -0,0 +1,127 @@
+import os
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from rich import print
+
+import historyStore
+from api import get_vin_data, revalidate_vin_data, validate_vin, retry, RateLimiter, VINDataError
+from historyUtils import migrate_legacy_history, save_vin_lookups, is_fresh
+from log import logger
+from memory import stage
+
+# Defaults for unattended cache warm-up runs
+PREFETCH_RATE = float(os.environ.get("AUTOLOOKUP_PREFETCH_RATE", "2"))  # lookups per second
+PREFETCH_WORKERS = int(os.environ.get("AUTOLOOKUP_PREFETCH_WORKERS", "4"))
+SAVE_CHUNK = 50
+
+## VIN sources ##
+def vins_from_file(path: str) -> list[str]:
+    vins = []
+    with open(path, "r") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            try:
+                vins.append(validate_vin(line))
+            except VINDataError as e:
+                logger.warning(f"Skipping invalid VIN in prefetch file: {line.strip()} - {e}")
+    return list(dict.fromkeys(vins))
+
+def _looked_up_vins():
+    # Only user lookups count, otherwise entries saved by prefetch or refresh would reinforce every run
+    for entry in historyStore.iter_entries():
+        if entry.get("vin") and not entry.get("source"):
+            yield entry["vin"]
+
+def recent_vins(count: int) -> list[str]:
+    # History is in lookup order, so the last occurrence of each VIN is its most recent lookup
+    if count < 1:
+        return []
+    migrate_legacy_history()
+    latest = {}
+    for vin in _looked_up_vins():
+        latest.pop(vin, None)
+        latest[vin] = None
+    return list(latest)[-count:][::-1]
+
+def frequent_vins(count: int) -> list[str]:
+    if count < 1:
+        return []
+    migrate_legacy_history()
+    counts = Counter(_looked_up_vins())
+    return [vin for vin, _ in counts.most_common(count)]
+
+## Warm-up ##
+def _warm(vin: str, limiter: RateLimiter):
+    # Returns (outcome, record); outcome is "fresh", "revalidated" or "fetched"
+    record = historyStore.find_latest(vin)
+    if record is not None and is_fresh(record):
+        return "fresh", None
+    # The limiter is applied per request, so retries, provider fallbacks and hedges stay under the rate
+    if record is not None:
+        # Conditional request, the provider can answer 304 and the payload is reused
+        return "revalidated", retry(lambda: revalidate_vin_data(record, limiter), attempts=2, delay=2, exceptions=(Exception,), quiet=True)
+    return "fetched", retry(lambda: get_vin_data(vin, show_spinner=False, limiter=limiter), attempts=2, delay=2, exceptions=(Exception,), quiet=True)
+
+def prefetch(vins: list[str], rate: float = PREFETCH_RATE, workers: int = PREFETCH_WORKERS) -> dict:
+    """Warm the history cache for ``vins``, skipping entries that are still fresh.
+
+    Lookups run on ``workers`` threads but start at most ``rate`` times per second.
+    Returns counts per outcome plus ``failed`` and ``duration`` in seconds.
+    """
+    migrate_legacy_history()
+    started = time.perf_counter()
+    limiter = RateLimiter(rate)
+    summary = {"fresh": 0, "revalidated": 0, "fetched": 0, "failed": 0}
+    to_save = []
+
+    logger.info(f"Prefetch started for {len(vins)} VINs at up to {rate} lookups/s with {workers} workers")
+    with stage("fetch"), ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="prefetch") as pool:
+        futures = {pool.submit(_warm, vin, limiter): vin for vin in vins}
+        for future in as_completed(futures):
+            vin = futures[future]
+            try:
+                outcome, record = future.result()
+            except Exception as e:
+                logger.error(f"Prefetch failed for VIN {vin}: {e}")
+                summary["failed"] += 1
+                continue
+            summary[outcome] += 1
+            if record is not None:
+                to_save.append(record)
+                if len(to_save) >= SAVE_CHUNK:
+                    save_vin_lookups(to_save, source="prefetch")
+                    to_save = []
+    save_vin_lookups(to_save, source="prefetch")
+
+    summary["duration"] = time.perf_counter() - started
+    logger.info(f"Prefetch finished: {summary}")
+    return summary
+
+def run_prefetch(file: str = None, recent: int = None, frequent: int = None,
+                 rate: float = PREFETCH_RATE, workers: int = PREFETCH_WORKERS) -> int:
+    # Entry point for the prefetch command; returns the process exit code
+    if file is not None:
+        if not os.path.exists(file):
+            print(f"[red]File not found: {file}[/red]")
+            return 2
+        vins, source = vins_from_file(file), file
+    elif recent is not None:
+        vins, source = recent_vins(recent), f"{recent} most recent"
+    elif frequent is not None:
+        vins, source = frequent_vins(frequent), f"{frequent} most frequent"
+    else:
+        raise ValueError("run_prefetch needs one of file, recent or frequent")
+
+    if not vins:
+        print("[yellow]No VINs to prefetch.[/yellow]")
+        return 0
+
+    print(f"[cyan]Prefetching {len(vins)} VINs ({source}) at up to {rate:g} lookups/s...[/cyan]")
+    summary = prefetch(vins, rate=rate, workers=workers)
+    warmed = summary["fetched"] + summary["revalidated"]
+    print(f"[bold green]Prefetch complete:[/bold green] {warmed} warmed "
+          f"({summary['fetched']} fetched, {summary['revalidated']} revalidated), "
+          f"{summary['fresh']} already fresh, {summary['failed']} failed in {summary['duration']:.1f}s")
+    return 1 if summary["failed"] else 0
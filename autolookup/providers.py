@@ -0,0 +1,139 @@
+import time
+import threading
+from collections import deque
+import requests
+
+# vPIC field -> field name used in history and exports (db.vin style)
+NHTSA_FIELDS = {
+    "VIN": "vin",
+    "Make": "brand",
+    "Model": "model",
+    "ModelYear": "year",
+    "Manufacturer": "manufacturer",
+    "Trim": "trim",
+    "Series": "series",
+    "BodyClass": "body",
+    "VehicleType": "type",
+    "Doors": "doors",
+    "DriveType": "drive",
+    "EngineModel": "engine",
+    "EngineCylinders": "engine_cylinders",
+    "DisplacementL": "engine_displacement",
+    "EngineHP": "engine_hp",
+    "FuelTypePrimary": "fuel_type",
+    "TransmissionStyle": "transmission",
+    "PlantCountry": "plant_country",
+    "PlantState": "plant_state",
+    "PlantCity": "plant_city",
+}
+
+### Provider Interface ###
+class Provider:
+    """A VIN decode service with its own health and latency tracking.
+
+    Subclasses set ``name`` and implement ``normalize``, which maps the provider's
+    response to the shared field schema or returns None when the VIN was not decoded.
+    """
+
+    name = "provider"
+    LATENCY_SAMPLES = 200
+    FAILURE_THRESHOLD = 3  # consecutive failures before the provider is skipped
+    COOLDOWN = 60  # seconds an unhealthy provider is skipped for
+    DEFAULT_HEDGE_DELAY = 1.0  # seconds, until enough latency samples exist
+    MIN_HEDGE_DELAY = 0.05  # seconds; a very fast provider would otherwise be hedged on every request
+
+    def __init__(self, url: str):
+        self.url = url
+        self.latencies = deque(maxlen=self.LATENCY_SAMPLES)
+        self.successes = 0
+        self.failures = 0
+        self.consecutive_failures = 0
+        self.down_until = 0.0
+        self._lock = threading.Lock()
+
+    def request(self, vin: str, etag: str = None, last_modified: str = None, timeout: float = None):
+        headers = {}
+        if etag:
+            headers["If-None-Match"] = etag
+        if last_modified:
+            headers["If-Modified-Since"] = last_modified
+        return requests.get(self.url.format(vin=vin.strip()), headers=headers, timeout=timeout)
+
+    def normalize(self, payload) -> dict | None:
+        raise NotImplementedError
+
+    def record_success(self, latency: float):
+        with self._lock:
+            self.latencies.append(latency)
+            self.successes += 1
+            self.consecutive_failures = 0
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self.consecutive_failures += 1
+            if self.consecutive_failures >= self.FAILURE_THRESHOLD:
+                self.down_until = time.monotonic() + self.COOLDOWN
+
+    def healthy(self) -> bool:
+        return time.monotonic() >= self.down_until
+
+    def p95(self) -> float | None:
+        with self._lock:
+            samples = sorted(self.latencies)
+        if len(samples) < 5:
+            return None
+        return samples[min(len(samples) - 1, int(len(samples) * 0.95))]
+
+    def hedge_delay(self) -> float:
+        p95 = self.p95()
+        return self.DEFAULT_HEDGE_DELAY if p95 is None else max(self.MIN_HEDGE_DELAY, p95)
+
+    def __repr__(self):
+        p95 = self.p95()
+        return (f"{self.name}(ok={self.successes}, failed={self.failures}, "
+                f"p95={'n/a' if p95 is None else f'{p95 * 1000:.0f}ms'}, healthy={self.healthy()})")
+
+class DbVinProvider(Provider):
+    name = "db.vin"
+
+    def normalize(self, payload) -> dict | None:
+        if not isinstance(payload, dict) or not payload:
+            return None
+        data = dict(payload)
+        if "brand" not in data and "make" in data:
+            data["brand"] = data.pop("make")
+        return data
+
+class NhtsaProvider(Provider):
+    name = "nhtsa"
+    BULK_LIMIT = 50  # VINs per DecodeVINValuesBatch request
+
+    def __init__(self, url: str, bulk_url: str = None):
+        super().__init__(url)
+        self.bulk_url = bulk_url
+
+    def request_bulk(self, vins: list[str], timeout: float = None):
+        return requests.post(self.bulk_url, data={"format": "json", "data": ";".join(vins)}, timeout=timeout)
+
+    def normalize(self, payload) -> dict | None:
+        results = (payload or {}).get("Results") or []
+        if not results:
+            return None
+        return normalize_nhtsa_result(results[0])
+
+def normalize_nhtsa_result(result: dict) -> dict | None:
+    data = {}
+    for source, target in NHTSA_FIELDS.items():
+        value = result.get(source)
+        if value not in (None, "", "Not Applicable"):
+            data[target] = value
+    if "year" in data:
+        try:
+            data["year"] = int(data["year"])
+        except ValueError:
+            pass
+    # vPIC answers 200 even for VINs it cannot decode
+    if not data.get("brand") and not data.get("model"):
+        return None
+    return data
@@ -0,0 +1,110 @@
+import sys
+import json
+
+# Payload keys that feed each normalized attribute, in lookup order
+FIELD_ALIASES = {
+    "make": ("brand", "make"),
+    "model": ("model",),
+    "year": ("year",),
+}
+
+def _intern(value):
+    if isinstance(value, str):
+        return sys.intern(value)
+    return value
+
+def _intern_pairs(pairs):
+    # Payload field names repeat across every record, share one copy of each
+    return {sys.intern(key): value for key, value in pairs}
+
+def _pick(data: dict, attribute: str):
+    for key in FIELD_ALIASES[attribute]:
+        value = data.get(key)
+        if value not in (None, ""):
+            return value
+    return None
+
+def _to_year(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+### VIN Record ###
+class VinRecord:
+    """Compact VIN lookup record.
+
+    Core attributes are normalized up front; the raw API payload is kept
+    as compact JSON text and only decoded when ``data`` is accessed.
+    """
+
+    __slots__ = ("vin", "make", "model", "year", "timestamp", "fetched_at", "etag", "last_modified", "provider", "source", "_raw")
+
+    def __init__(self, vin, make=None, model=None, year=None, timestamp=None,
+                 fetched_at=None, etag=None, last_modified=None, provider=None, source=None, raw="{}"):
+        self.vin = _intern(vin)
+        self.make = _intern(make)
+        self.model = _intern(model)
+        self.year = year
+        self.timestamp = timestamp
+        # Freshness metadata: when the payload came from the API and its HTTP validators
+        self.fetched_at = fetched_at
+        self.etag = etag
+        self.last_modified = last_modified
+        # Name of the decode provider that answered
+        self.provider = _intern(provider)
+        # What saved the entry: None for a user lookup, "prefetch" or "refresh" for background warm-ups
+        self.source = _intern(source)
+        self._raw = raw
+
+    @classmethod
+    def from_payload(cls, data: dict, vin: str = None, timestamp: str = None, **metadata):
+        data = data or {}
+        return cls(
+            vin=(data.get("vin") or vin or "").strip().upper() or None,
+            make=_pick(data, "make"),
+            model=_pick(data, "model"),
+            year=_to_year(_pick(data, "year")),
+            timestamp=timestamp,
+            raw=json.dumps(data, separators=(",", ":")),
+            **metadata,
+        )
+
+    @classmethod
+    def from_entry(cls, entry: dict):
+        return cls.from_payload(
+            entry.get("data") or {},
+            vin=entry.get("vin"),
+            timestamp=entry.get("timestamp"),
+            # Entries written before freshness tracking were fetched when they were saved
+            fetched_at=entry.get("fetched_at") or entry.get("timestamp"),
+            etag=entry.get("etag"),
+            last_modified=entry.get("last_modified"),
+            provider=entry.get("provider"),
+            source=entry.get("source"),
+        )
+
+    @property
+    def data(self) -> dict:
+        return json.loads(self._raw, object_pairs_hook=_intern_pairs)
+
+    def replace(self, **changes):
+        record = VinRecord.__new__(VinRecord)
+        for slot in self.__slots__:
+            setattr(record, slot, changes.get(slot.lstrip("_"), getattr(self, slot)))
+        return record
+
+    def to_entry(self) -> dict:
+        return {
+            "timestamp": self.timestamp,
+            "vin": self.vin,
+            "fetched_at": self.fetched_at,
+            "etag": self.etag,
+            "last_modified": self.last_modified,
+            "provider": self.provider,
+            "source": self.source,
+            "data": self.data,
+        }
+
+    def __repr__(self):
+        return f"VinRecord(vin={self.vin!r}, make={self.make!r}, model={self.model!r}, year={self.year!r})"
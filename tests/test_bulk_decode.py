@@ -0,0 +1,124 @@
+import os
+import sys
+import importlib
+import pytest
+import requests
+
+AUTOLOOKUP = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "autolookup")
+
+class StubResponse:
+    def __init__(self, payload, status_code=200):
+        self.status_code = status_code
+        self.ok = status_code < 400
+        self.headers = {}
+        self.text = str(payload)
+        self._payload = payload
+
+    def json(self):
+        return self._payload
+
+class StubProviders:
+    """Local stand-in for db.vin and vPIC that counts the requests it serves."""
+
+    def __init__(self, missing=(), undecodable=(), unknown=(), bulk_down=False):
+        self.missing = set(missing)  # left out of bulk responses
+        self.undecodable = set(undecodable)  # in bulk responses, but without make or model
+        self.unknown = set(unknown)  # rejected by every single-VIN endpoint as well
+        self.bulk_down = bulk_down
+        self.chunks = []
+        self.gets = []
+
+    def post(self, url, data=None, timeout=None):
+        if self.bulk_down:
+            raise requests.ConnectionError("bulk endpoint unreachable")
+        vins = data["data"].split(";")
+        self.chunks.append(len(vins))
+        results = [
+            {"VIN": vin, "Make": "", "Model": "", "ModelYear": ""} if vin in self.undecodable
+            else {"VIN": vin, "Make": "JEEP", "Model": "Wrangler", "ModelYear": "2012"}
+            for vin in vins if vin not in self.missing
+        ]
+        return StubResponse({"Count": len(results), "Results": results})
+
+    def get(self, url, headers=None, timeout=None):
+        vin = url.split("?")[0].rstrip("/").rsplit("/", 1)[-1]
+        self.gets.append(vin)
+        if vin in self.unknown:
+            return StubResponse({"error": "VIN not found"}, status_code=404)
+        return StubResponse({"brand": "Jeep", "model": "Wrangler", "year": 2012})
+
+def _vins(prefix: str, count: int) -> list[str]:
+    return [f"1C4HJW{prefix}CL{i:06d}" for i in range(count)]
+
+@pytest.fixture
+def api(tmp_path, monkeypatch):
+    # The modules open their log and history files in the working directory on import
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.syspath_prepend(AUTOLOOKUP)
+    api = importlib.import_module("api")
+    # Retries back off with real sleeps between attempts
+    monkeypatch.setattr(api.time, "sleep", lambda seconds: None)
+    for provider in api.PROVIDERS:
+        provider.consecutive_failures = 0
+        provider.down_until = 0.0
+    return api
+
+def _stub(monkeypatch, **options) -> StubProviders:
+    stub = StubProviders(**options)
+    monkeypatch.setattr(requests, "post", stub.post)
+    monkeypatch.setattr(requests, "get", stub.get)
+    return stub
+
+def test_bulk_decode_sends_chunks_of_fifty(api, monkeypatch):
+    stub = _stub(monkeypatch)
+    vins = _vins("001", 120)
+
+    results = list(api.decode_vins_bulk(vins + vins[:10]))
+
+    assert stub.chunks == [50, 50, 20]
+    assert stub.gets == []
+    assert [vin for vin, _, _ in results] == vins
+    assert all(record is not None and record.make == "JEEP" and error is None for _, record, error in results)
+
+def test_vins_missing_from_the_bulk_response_fall_back_per_vin(api, monkeypatch):
+    vins = _vins("002", 60)
+    missing, undecodable, unknown = vins[3], vins[55], vins[10]
+    stub = _stub(monkeypatch, missing=[missing, unknown], undecodable=[undecodable], unknown=[unknown])
+
+    results = {vin: (record, error) for vin, record, error in api.decode_vins_bulk(vins)}
+
+    assert stub.chunks == [50, 10]
+    # Only the VINs the bulk response did not decode are looked up one by one
+    assert sorted(set(stub.gets)) == sorted([missing, undecodable, unknown])
+    assert results[missing][0].provider == "db.vin"
+    assert results[undecodable][0].provider == "db.vin"
+    assert results[unknown][0] is None and results[unknown][1] is not None
+    assert all(record is not None for vin, (record, _) in results.items() if vin != unknown)
+
+def test_a_failed_chunk_falls_back_per_vin(api, monkeypatch):
+    stub = _stub(monkeypatch, bulk_down=True)
+    vins = _vins("003", 5)
+
+    results = list(api.decode_vins_bulk(vins))
+
+    assert sorted(stub.gets) == vins
+    assert all(record is not None for _, record, _ in results)
+
+def test_bulk_sends_fewer_requests_than_per_vin_lookups(api, monkeypatch):
+    inputs = importlib.import_module("inputs")
+    vins = _vins("004", 101)
+
+    stub = _stub(monkeypatch)
+    bulk = list(inputs._fetch_uncached(vins))
+    bulk_requests = len(stub.chunks) + len(stub.gets)
+
+    # AUTOLOOKUP_BULK=0; other VINs so single-flight results from the bulk run are not reused
+    monkeypatch.setattr(inputs, "BULK_DECODE", False)
+    vins = _vins("005", 101)
+    stub = _stub(monkeypatch)
+    single = list(inputs._fetch_uncached(vins))
+    single_requests = len(stub.chunks) + len(stub.gets)
+
+    assert len(bulk) == len(single) == 101
+    assert bulk_requests == 3
+    assert single_requests == 101
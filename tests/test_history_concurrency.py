@@ -0,0 +1,112 @@
+import os
+import sys
+import threading
+import multiprocessing
+
+AUTOLOOKUP = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "autolookup")
+WRITERS = 12
+SAVES = 150
+READERS = 3
+LOOKUP_THREADS = 4
+COMPACTIONS = 200
+TIMEOUT = 300
+
+def _vin(writer: int, i: int) -> str:
+    return f"1C4HJW{writer:03d}CL{i:06d}"
+
+def _open_store(workdir: str):
+    # History paths are taken from the working directory when the modules are imported
+    os.chdir(workdir)
+    sys.path.insert(0, AUTOLOOKUP)
+
+def _writer(workdir: str, writer: int):
+    _open_store(workdir)
+    import historyUtils
+    for i in range(SAVES):
+        historyUtils.save_vin_lookup({"vin": _vin(writer, i), "brand": "Jeep", "model": "Wrangler", "year": 2012})
+
+def _reader(workdir: str, stop, scans):
+    _open_store(workdir)
+    import historyStore
+    while not stop.is_set():
+        # A half-written block would surface as a missing VIN or a decode error here
+        for entry in historyStore.iter_entries():
+            assert entry.get("vin")
+        historyStore.find_latest(_vin(0, 0))
+        with scans.get_lock():
+            scans.value += 1
+
+def _verify(workdir: str, results):
+    _open_store(workdir)
+    import historyStore
+    vins = [entry.get("vin") for entry in historyStore.iter_entries()]
+    unresolved = [vin for vin in set(vins) if historyStore.find_latest(vin) is None]
+    results.put((vins, unresolved))
+
+def _lookups_during_compaction(workdir: str, results):
+    _open_store(workdir)
+    import historyStore
+    from vinRecord import VinRecord
+    vins = [_vin(0, i) for i in range(SAVES * 10)]
+    historyStore.append_records([VinRecord.from_payload({"brand": "Jeep"}, vin=vin) for vin in vins])
+    errors = []
+    stop = threading.Event()
+
+    def lookup():
+        # Each compaction replaces the index file that these threads have mapped
+        while not stop.is_set():
+            try:
+                for vin in vins[::37]:
+                    assert historyStore.find_latest(vin) is not None, vin
+            except Exception as e:
+                errors.append(repr(e))
+                return
+
+    threads = [threading.Thread(target=lookup) for _ in range(LOOKUP_THREADS)]
+    for thread in threads:
+        thread.start()
+    for _ in range(COMPACTIONS):
+        historyStore.compact_index()
+    stop.set()
+    for thread in threads:
+        thread.join(TIMEOUT)
+    results.put(errors)
+
+def test_lookups_survive_index_compaction(tmp_path):
+    ctx = multiprocessing.get_context("spawn")
+    results = ctx.Queue()
+    process = ctx.Process(target=_lookups_during_compaction, args=(str(tmp_path), results))
+    process.start()
+    errors = results.get(timeout=TIMEOUT)
+    process.join(TIMEOUT)
+    assert errors == []
+    assert process.exitcode == 0
+
+def test_concurrent_writers_lose_no_entries(tmp_path):
+    ctx = multiprocessing.get_context("spawn")
+    workdir = str(tmp_path)
+    stop = ctx.Event()
+    scans = ctx.Value("i", 0)
+
+    readers = [ctx.Process(target=_reader, args=(workdir, stop, scans)) for _ in range(READERS)]
+    writers = [ctx.Process(target=_writer, args=(workdir, writer)) for writer in range(WRITERS)]
+    for process in readers + writers:
+        process.start()
+    for process in writers:
+        process.join(TIMEOUT)
+    stop.set()
+    for process in readers:
+        process.join(TIMEOUT)
+
+    assert [process.exitcode for process in writers + readers] == [0] * (WRITERS + READERS)
+    assert scans.value > 0
+
+    results = ctx.Queue()
+    verifier = ctx.Process(target=_verify, args=(workdir, results))
+    verifier.start()
+    vins, unresolved = results.get(timeout=TIMEOUT)
+    verifier.join(TIMEOUT)
+
+    expected = [_vin(writer, i) for writer in range(WRITERS) for i in range(SAVES)]
+    assert sorted(vins) == sorted(expected)
+    assert unresolved == []